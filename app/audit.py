@@ -0,0 +1,192 @@
+import hashlib
+import hmac
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import insert
+
+from app.auth import SECRET_KEY
+from app.breaker import DatabaseUnavailable, db_breaker
+from app.config import settings
+from app.db import SessionLocal
+from app.models import AuditEvent
+
+logger = logging.getLogger(__name__)
+
+
+def email_digest(email: str) -> str:
+    """
+    keyed hash of an email, failed logins can be correlated without the
+    audit table holding addresses of people who may not be users
+    """
+    key = (SECRET_KEY or "").encode()
+    normalised = email.strip().lower().encode()
+    return hmac.new(key, normalised, hashlib.sha256).hexdigest()
+
+
+class AuditLog:
+    """
+    buffer audit events in memory and insert them in batches from a
+    background thread so requests never wait on the audit table
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        queue_size: int = settings.audit_queue_size,
+        batch_size: int = settings.audit_batch_size,
+        flush_seconds: float = settings.audit_flush_seconds,
+        enqueue_timeout: float = settings.audit_enqueue_timeout,
+        spill_size: int = settings.audit_spill_size,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.enqueue_timeout = enqueue_timeout
+        self.spill_size = spill_size
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        # events whose inline write failed, retried before anything newer
+        self._spill: deque = deque()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(
+        self,
+        event_type: str,
+        actor_id: Optional[str] = None,
+        subject_id: Optional[str] = None,
+        **details,
+    ):
+        """
+        enqueue an event, when the queue stays full the caller writes it
+        """
+        event = {
+            "event_type": event_type,
+            "actor_id": str(actor_id) if actor_id else None,
+            "subject_id": str(subject_id) if subject_id else None,
+            "details": details,
+            "created_at": datetime.now(),
+        }
+        if not self.running:
+            self._write_inline(event)
+            return
+        try:
+            self._queue.put(event, timeout=self.enqueue_timeout)
+        except queue.Full:
+            logger.warning("audit queue is full, writing event inline")
+            self._write_inline(event)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _write(self, events: List[dict]):
+        with self.session_factory() as db:
+            db.execute(insert(AuditEvent), events)
+            db.commit()
+
+    def _write_inline(self, event: dict):
+        try:
+            # no request waits on a database the breaker knows is down
+            db_breaker.before_call()
+        except DatabaseUnavailable:
+            self._keep([], [event])
+            return
+        events = self._take_spill() + [event]
+        try:
+            self._write(events)
+        except Exception:
+            logger.exception(
+                "writing %d audit events failed, kept for retry", len(events)
+            )
+            self._keep(events)
+
+    def _keep(self, failed: List[dict], newer: Iterable[dict] = ()):
+        """
+        put ``failed`` back in front of the spill and ``newer`` behind it,
+        the oldest events are dropped once the spill is over its size
+        """
+        self._spill.extendleft(reversed(failed))
+        self._spill.extend(newer)
+        dropped = 0
+        while len(self._spill) > self.spill_size:
+            self._spill.popleft()
+            dropped += 1
+        if dropped:
+            logger.error("audit spill is full, dropped %d events", dropped)
+
+    def _take_spill(self) -> List[dict]:
+        events = []
+        while True:
+            try:
+                events.append(self._spill.popleft())
+            except IndexError:
+                return events
+
+    def _next_batch(self) -> List[dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        batch: List[dict] = []
+        while not (
+            self._stop.is_set()
+            and self._queue.empty()
+            and not self._spill
+            and not batch
+        ):
+            # a failed batch is kept and retried so no event is dropped
+            batch = batch or self._take_spill() or self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+                batch = []
+            except Exception:
+                logger.exception("flushing %d audit events failed", len(batch))
+                if self._stop.wait(self.flush_seconds):
+                    break
+        self._keep(batch)
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="audit-flush", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        flush everything still queued and stop the background thread
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        while not self._queue.empty():
+            self._keep([], [self._queue.get_nowait()])
+        if self._spill:
+            self._write_inline(self._spill.pop())
+        if self._spill:
+            logger.error(
+                "%d audit events could not be stored", len(self._spill)
+            )
+
+
+audit_log = AuditLog()
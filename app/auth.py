@@ -2,6 +2,7 @@ import os
 from datetime import datetime, timedelta
 from functools import wraps
 from typing import Optional
+from uuid import uuid4
 
 import jwt
 from dotenv import load_dotenv
@@ -10,11 +11,23 @@ from fastapi.responses import JSONResponse
 from jwt.exceptions import PyJWTError
 import os
 
+from app.breaker import StaleCache
+from app.config import settings
+from app.revocation import revocation_list
+
 load_dotenv()
 
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 ALGORITHM = 'HS256'
+# token claim holding the profile snapshot, kept apart from the profile
+# token's own claims
+PROFILE_CLAIM = 'pf'
+# bump when the layout of the profile claim changes
+PROFILE_SNAPSHOT_VERSION = 1
+
+# newest profile version this worker has seen for each user
+profile_versions = StaleCache(max_size=settings.profile_version_cache_size)
 
 
 
@@ -30,22 +43,71 @@ class JwtGenerator:
         else:
             expires= datetime.now() + timedelta(minutes=4)
 
-        data.update({'exp': expires})
+        data.update({'exp': expires, 'jti': uuid4().hex})
         return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
 
     @staticmethod
-    def get_current_user(token: Optional[str] = None) -> str:
+    def get_token_claims(token: Optional[str] = None) -> Optional[dict]:
         """
-        verfy the provided access token given
+        decode the access token, revoked tokens are treated as invalid
         """
-        user_id = None
         try:
-            user = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_id = user.get('userId')
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         except PyJWTError:
-            user_id = None
+            return None
+        if revocation_list.is_revoked(claims.get('jti')):
+            return None
+        return claims
+
+    @staticmethod
+    def get_current_user(token: Optional[str] = None) -> str:
+        """
+        verfy the provided access token given
+        """
+        claims = JwtGenerator.get_token_claims(token)
+        return claims.get('userId') if claims else None
+
+
+def note_profile_version(user_id: str, version: int):
+    """
+    remember a profile version read from the database
+    """
+    known = profile_versions.get(user_id)
+    if known is None or version > known:
+        profile_versions.set(user_id, version)
+
+
+def profile_claims(user_dict: dict) -> dict:
+    """
+    compact profile snapshot signed into the access token
+    """
+    return {
+        'sv': PROFILE_SNAPSHOT_VERSION,
+        'v': user_dict.get('version', 0),
+        'fn': user_dict['first_name'],
+        'ln': user_dict['last_name'],
+        'em': user_dict['email'],
+        'ph': user_dict['phone'],
+    }
+
 
-        return user_id
+def profile_from_claims(claims: Optional[dict]) -> Optional[dict]:
+    """
+    user data from the token snapshot, None when it is missing or stale
+    """
+    profile = claims.get(PROFILE_CLAIM) if claims else None
+    if not profile or profile.get('sv') != PROFILE_SNAPSHOT_VERSION:
+        return None
+    known = profile_versions.get(claims['userId'])
+    if known is not None and known > profile['v']:
+        return None
+    return {
+        'userId': claims['userId'],
+        'first_name': profile['fn'],
+        'last_name': profile['ln'],
+        'email': profile['em'],
+        'phone': profile['ph'],
+    }
 
 
 def login_required(func):
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from app.config import settings
+
+
+class DatabaseUnavailable(Exception):
+    """
+    raised instead of touching the database while the breaker is open
+    """
+
+
+class CircuitBreaker:
+    """
+    trips after consecutive failures or a high error rate over the last
+    calls, fails fast while open and lets a single probe through once the
+    reset timeout has passed
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = settings.breaker_failure_threshold,
+        error_rate: float = settings.breaker_error_rate,
+        window: int = settings.breaker_window,
+        reset_seconds: float = settings.breaker_reset_seconds,
+    ):
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        raise DatabaseUnavailable unless a call may go through right now
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now - self._opened_at < self.reset_seconds:
+                    raise DatabaseUnavailable()
+                self.state = self.HALF_OPEN
+            elif now - self._probe_started < self.reset_seconds:
+                # a probe is already checking whether the database is back
+                raise DatabaseUnavailable()
+            self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            self._outcomes.append(False)
+            self._consecutive_failures = 0
+            if self.state != self.CLOSED:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append(True)
+            self._consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self._should_trip():
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def _should_trip(self) -> bool:
+        if self._consecutive_failures >= self.failure_threshold:
+            return True
+        if len(self._outcomes) < self._outcomes.maxlen:
+            return False
+        failures = sum(self._outcomes)
+        return failures / len(self._outcomes) >= self.error_rate
+
+
+class StaleCache:
+    """
+    bounded lru of the last good response bodies, served while the
+    database cannot be reached
+    """
+
+    def __init__(self, max_size: int = settings.stale_cache_size):
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set(self, key: str, content):
+        with self._lock:
+            self._items[key] = content
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            content = self._items.get(key)
+            if content is not None:
+                self._items.move_to_end(key)
+            return content
+
+
+def stale_key(request) -> str:
+    """
+    responses are cached per viewer so nobody is served another user's view
+    """
+    viewer = request.user.username if request.user.is_authenticated else ""
+    return f"{viewer}:{request.url.path}"
+
+
+db_breaker = CircuitBreaker()
+stale_cache = StaleCache()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_breaker_timer(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("breaker_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_statement_outcome(
+    conn, cursor, statement, parameters, context, many
+):
+    started = conn.info.get("breaker_started")
+    elapsed = time.perf_counter() - started.pop() if started else 0.0
+    if elapsed > settings.breaker_slow_seconds:
+        db_breaker.record_failure()
+    else:
+        db_breaker.record_success()
+
+
+@event.listens_for(Engine, "handle_error")
+def record_statement_error(exception_context):
+    started = (
+        exception_context.connection.info.get("breaker_started")
+        if exception_context.connection is not None
+        else None
+    )
+    if started:
+        started.pop()
+    error = exception_context.sqlalchemy_exception
+    if exception_context.is_disconnect or isinstance(
+        error, (OperationalError, InterfaceError)
+    ):
+        db_breaker.record_failure()
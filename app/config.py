@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -8,11 +8,69 @@ class Settings(BaseSettings):
     """
 
     model_config = SettingsConfigDict(
-        env_file=".env", env_file_encoding="utf-8"
+        env_file=".env", env_file_encoding="utf-8", extra="ignore"
     )
     database_url: Optional[str] = ''
     secret_key: Optional[str] = ''
     test_database_url: Optional[str] = ''
     algorithm: str = "HS256"
+    # maximum number of ids (users + organisations) in one batch read
+    batch_max_ids: int = 100
+    # most organisations one name search may return
+    org_search_max_limit: int = 50
+    # user shards as {"name": "postgresql+psycopg://..."}, empty keeps users
+    # on the primary database, names must stay stable once data is written
+    user_shards: Dict[str, str] = {}
+    # points per shard on the consistent hash ring
+    shard_virtual_nodes: int = 64
+    # look for users missing from the email directory on every shard at
+    # login, unset means only while users live on the primary, turn it off
+    # once ``python -m app.sharding prepare`` has filled the directory
+    directory_legacy_scan: Optional[bool] = None
+    # two shard databases for the sharding integration tests
+    test_user_shards: Dict[str, str] = {}
+    # users whose latest profile version is remembered to spot stale tokens
+    profile_version_cache_size: int = 10_000
+    # psycopg prepares a statement server side once a connection has run it
+    # this many times, None turns it off (needed behind pgbouncer)
+    db_prepare_threshold: Optional[int] = 1
+    # bound how long a request can wait on the database
+    db_pool_timeout: float = 5.0
+    db_connect_timeout: int = 5
+    db_statement_timeout_ms: int = 5000
+    # database circuit breaker and stale read cache
+    breaker_failure_threshold: int = 5
+    breaker_error_rate: float = 0.5
+    breaker_window: int = 20
+    breaker_reset_seconds: float = 10.0
+    breaker_slow_seconds: float = 2.0
+    stale_cache_size: int = 1000
+    # token revocation bloom filter
+    revocation_capacity: int = 100_000
+    revocation_error_rate: float = 0.001
+    revocation_refresh_seconds: float = 5.0
+    revocation_rebuild_seconds: float = 600.0
+    # request profiling, also enabled per request by a signed X-Profile header
+    profiling_enabled: bool = False
+    profiling_cpu: bool = False
+    profiling_repeat_threshold: int = 3
+    profiling_sample_interval: float = 0.005
+    profiling_dump_dir: str = "profiles"
+    # Idempotency-Key replay for POST routes
+    idempotency_ttl_seconds: float = 3600.0
+    idempotency_max_entries: int = 10_000
+    idempotency_wait_seconds: float = 30.0
+    # group commit for concurrent membership writes, a batch waits at most
+    # this long to fill and only when other writes are in flight
+    membership_batch_seconds: float = 0.002
+    membership_batch_size: int = 200
+    # write-behind audit log
+    audit_queue_size: int = 10_000
+    audit_batch_size: int = 500
+    audit_flush_seconds: float = 1.0
+    audit_enqueue_timeout: float = 0.05
+    # events held for retry while the database is down, oldest dropped first
+    audit_spill_size: int = 50_000
 
 
+settings = Settings()
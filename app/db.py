@@ -6,12 +6,31 @@ from dotenv import load_dotenv
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from app.config import settings
+
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent
 sslrootcert = BASE_DIR / "ca.pem"
 
-DATABASE_URL = f"postgresql://{os.getenv('USERS')}:{os.getenv('PASSWORD')}@{os.getenv('HOST_NAME')}:{int(os.getenv('PORT'))}/{os.getenv('DATABASE')}"
-engine = create_engine(DATABASE_URL)
+DATABASE_URL = f"postgresql+psycopg://{os.getenv('USERS')}:{os.getenv('PASSWORD')}@{os.getenv('HOST_NAME')}:{int(os.getenv('PORT'))}/{os.getenv('DATABASE')}"
+
+
+def make_engine(url: str):
+    """
+    engine with the shared pool, prepare and timeout settings
+    """
+    return create_engine(
+        url,
+        pool_timeout=settings.db_pool_timeout,
+        connect_args={
+            "prepare_threshold": settings.db_prepare_threshold,
+            "connect_timeout": settings.db_connect_timeout,
+            "options": f"-c statement_timeout={settings.db_statement_timeout_ms}",
+        },
+    )
+
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
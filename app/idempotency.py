@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from app.config import settings
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+# session routes whose responses set or clear the token cookie, replaying
+# them would hand out a stale session
+SKIP_PATHS = {"/auth/login", "/auth/logout"}
+
+
+class IdempotentResponse:
+    """
+    the first response for a key, or a marker that it is still running
+    """
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.done = asyncio.Event()
+        self.messages: Optional[List[dict]] = None
+        self.expires_at = 0.0
+
+
+class IdempotencyStore:
+    """
+    bounded in-memory responses per idempotency key, local to this worker
+    """
+
+    def __init__(
+        self,
+        ttl: float = settings.idempotency_ttl_seconds,
+        max_entries: int = settings.idempotency_max_entries,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key) -> Optional[IdempotentResponse]:
+        entry = self._entries.get(key)
+        if entry and entry.messages is not None:
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+        return entry
+
+    def begin(self, key, fingerprint: str) -> IdempotentResponse:
+        entry = IdempotentResponse(fingerprint)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._evict()
+        return entry
+
+    def complete(self, key, entry: IdempotentResponse, messages: List[dict]):
+        entry.messages = messages
+        entry.expires_at = time.monotonic() + self.ttl
+        entry.done.set()
+
+    def abandon(self, key, entry: IdempotentResponse):
+        """
+        forget a request that failed so a retry runs it again
+        """
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        entry.done.set()
+
+    def _evict(self):
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                break
+            # requests still in flight are never evicted
+            if self._entries[key].messages is not None:
+                del self._entries[key]
+
+
+def error_messages(status_code: int, message: str) -> List[dict]:
+    content = {
+        "status": "Unprocessable Entity" if status_code == 422 else "Conflict",
+        "message": message,
+        "statusCode": status_code,
+    }
+    body = json.dumps(content).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+    ]
+    return [
+        {
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": headers,
+        },
+        {"type": "http.response.body", "body": body},
+    ]
+
+
+class IdempotencyMiddleware:
+    """
+    replay the stored response for POST retries carrying the same
+    Idempotency-Key, concurrent duplicates wait for the first to finish
+    """
+
+    def __init__(self, app, store: Optional[IdempotencyStore] = None):
+        self.app = app
+        self.store = store or IdempotencyStore()
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] in SKIP_PATHS
+        ):
+            return await self.app(scope, receive, send)
+        idempotency_key = dict(scope["headers"]).get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            return await self.app(scope, receive, send)
+
+        body = await self._read_body(receive)
+        fingerprint = hashlib.sha256(body).hexdigest()
+        user = scope.get("user")
+        viewer = user.username if user and user.is_authenticated else ""
+        key = (viewer, scope["path"], idempotency_key)
+
+        while True:
+            entry = self.store.get(key)
+            if entry is None:
+                break
+            if entry.fingerprint != fingerprint:
+                return await self._send(
+                    send,
+                    error_messages(
+                        422,
+                        "Idempotency-Key was used with a different request",
+                    ),
+                )
+            if entry.messages is not None:
+                return await self._send(send, entry.messages, replayed=True)
+            try:
+                await asyncio.wait_for(
+                    entry.done.wait(), settings.idempotency_wait_seconds
+                )
+            except asyncio.TimeoutError:
+                return await self._send(
+                    send,
+                    error_messages(
+                        409, "A request with this Idempotency-Key is running"
+                    ),
+                )
+
+        entry = self.store.begin(key, fingerprint)
+        messages = []
+        body_sent = False
+
+        async def replay_body():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def record(message):
+            messages.append(message)
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, record)
+        except BaseException:
+            self.store.abandon(key, entry)
+            raise
+        if messages and messages[0].get("status", 500) < 500:
+            self.store.complete(key, entry, messages)
+        else:
+            self.store.abandon(key, entry)
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _send(send, messages: List[dict], replayed: bool = False):
+        for message in messages:
+            if replayed and message["type"] == "http.response.start":
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", []))
+                    + [REPLAYED_HEADER],
+                }
+            await send(message)
@@ -1,16 +1,62 @@
+import logging
+from contextlib import asynccontextmanager
 from typing import Annotated, List
+from uuid import uuid4
 
-from app.auth import JwtGenerator, login_required
+from app.audit import audit_log, email_digest
+from app.auth import (
+    PROFILE_CLAIM,
+    JwtGenerator,
+    login_required,
+    note_profile_version,
+    profile_claims,
+    profile_from_claims,
+)
+from app.breaker import DatabaseUnavailable, db_breaker, stale_cache, stale_key
+from app.config import settings
 from app.db import SessionLocal, engine
-from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
+from app.idempotency import IdempotencyMiddleware
+from app.membership import add_member, membership_batcher
 from app.middleware import CustomAuthenticationMiddleWare
 from app.models import Base, Organization, User
+from app.profiling import ProfilingMiddleware
+from app.queries import (
+    as_uuid,
+    org_by_id,
+    org_by_name,
+    org_version,
+    orgs_by_ids,
+    orgs_for_user,
+    query_stats,
+    search_orgs,
+    user_by_id,
+    user_version,
+    users_by_ids,
+)
+from app.revocation import revocation_list
+from app.sharding import claim_email, shard_router, user_id_for_email
 from app.schemas import (
+    BatchOrgSchema,
+    BatchReadDataSchema,
+    BatchReadResponseSchema,
+    BatchReadSchema,
+    BatchUserSchema,
     OrgBaseSchema,
     OrgResponseSchema,
     OrgSchema,
+    OrgSearchResponseSchema,
+    OrgSearchSchema,
     UserData,
     UserDataSchema,
     UserDetailSchema,
@@ -22,25 +68,55 @@ from app.schemas import (
     UserPostSchema,
     UserResponseSchema,
 )
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import Session
 from starlette.middleware.authentication import AuthenticationMiddleware
 
 
-from app.utils import hash_password, post_login_response, post_response, verify_password
+from app.utils import (
+    etag_matches,
+    hash_password,
+    make_etag,
+    parse_uuids,
+    post_login_response,
+    post_response,
+    verify_password,
+)
 Base.metadata.create_all(bind=engine)
+shard_router.create_tables()
+
+logger = logging.getLogger(__name__)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    revocation_list.start()
+    audit_log.start()
+    yield
+    audit_log.stop()
+    revocation_list.stop()
+    logger.info("query cache stats: %s", query_stats())
 
 
+app = FastAPI(lifespan=lifespan)
+
+
+# replay POST retries that carry an Idempotency-Key, added before the
+# authentication middleware so it runs inside it and can scope keys per user
+app.add_middleware(IdempotencyMiddleware)
+
 # custom middle ware added
 app.add_middleware(
     AuthenticationMiddleware, backend=CustomAuthenticationMiddleWare()
 )
+# opt-in sql and cpu profiling, outermost so it sees the whole request
+app.add_middleware(ProfilingMiddleware)
 
 
 # get database session
 def get_db():
+    db_breaker.before_call()
     db = SessionLocal()
     try:
         yield db
@@ -60,26 +136,42 @@ def create_user(user: UserPostSchema, db: Session = Depends(get_db)):
     """
     password = hash_password(password=user.password)
     user = User(
+        userId=uuid4(),
         first_name=user.first_name,
         last_name=user.last_name,
         email=user.email,
         password=password,
         phone=user.phone,
     )
-    exist_user = db.query(User).filter(User.email == user.email).first()
-    if exist_user:
-        content = {
-            "status": "Bad Request",
-            "message": "Registration unsuccessful",
-            "statusCode": 400,
-        }
+    content = {
+        "status": "Bad Request",
+        "message": "Registration unsuccessful",
+        "statusCode": 400,
+    }
+    if not claim_email(db, user.email, user.userId):
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST, content=content
         )
-    db.add(user)
+    with shard_router.user_session(user.userId, db) as user_db:
+        user_db.add(user)
+        try:
+            user_db.commit()
+        except IntegrityError:
+            # registered before the email directory was filled
+            user_db.rollback()
+            db.rollback()
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST, content=content
+            )
+        user_db.refresh(user)
+        user_dict = user.to_dict()
+    # the directory row is committed once the user exists on its shard
     db.commit()
-    db.refresh(user)
-    user_dict = user.to_dict()
+    audit_log.record(
+        "user.registered",
+        actor_id=user_dict["userId"],
+        subject_id=user_dict["userId"],
+    )
     dct, _ = get_user_and_access_token(user_dict, "Registration successful")
     response = JSONResponse(status_code=201, content=dct)
     db.close()
@@ -92,7 +184,11 @@ def create_user(user: UserPostSchema, db: Session = Depends(get_db)):
     responses=post_login_response,
 )
 def login_user(user: UserLoginSchema, db: Session = Depends(get_db)):
-    user_db = db.query(User).filter(User.email == user.email).first()
+    user_db = None
+    user_id = user_id_for_email(db, user.email)
+    if user_id is not None:
+        with shard_router.user_session(user_id, db) as shard_db:
+            user_db = user_by_id(shard_db, user_id)
     password = (
         verify_password(user.password, user_db.password) if user_db else None
     )
@@ -102,8 +198,16 @@ def login_user(user: UserLoginSchema, db: Session = Depends(get_db)):
             "message": "Authentication failed",
             "statusCode": 401,
         }
+        audit_log.record(
+            "user.login_failed", email_digest=email_digest(user.email)
+        )
         return JSONResponse(status_code=401, content=detail)
     user_dict = user_db.to_dict()
+    audit_log.record(
+        "user.login",
+        actor_id=user_dict["userId"],
+        subject_id=user_dict["userId"],
+    )
     message = "Login successful"
     dct, access_token = get_user_and_access_token(user_dict, message)
     response = JSONResponse(status_code=200, content=dct)
@@ -112,12 +216,36 @@ def login_user(user: UserLoginSchema, db: Session = Depends(get_db)):
     return response
 
 
+@app.post("/auth/logout")
+@login_required
+def logout_user(request: Request, db: Session = Depends(get_db)):
+    """
+    revoke the current access token and clear the cookie
+    """
+    claims = JwtGenerator.get_token_claims(request.cookies.get("token"))
+    if claims and claims.get("jti"):
+        revocation_list.revoke(db, claims["jti"], claims["exp"])
+    audit_log.record(
+        "user.logout",
+        actor_id=request.user.username,
+        subject_id=request.user.username,
+    )
+    content = {"status": "success", "message": "Logout successful"}
+    response = JSONResponse(status_code=200, content=content)
+    response.delete_cookie(key="token", httponly=True)
+    db.close()
+    return response
+
+
 def get_user_and_access_token(user_dict: dict, message: str):
     """
     get user from the database and add access token to their response
     """
-    user_id = {"userId": user_dict["userId"]}
-    access_token = JwtGenerator.create_access_token(user_id)
+    claims = {
+        "userId": user_dict["userId"],
+        PROFILE_CLAIM: profile_claims(user_dict),
+    }
+    access_token = JwtGenerator.create_access_token(claims)
     user_info = UserData(**{"access_token": access_token, "user": user_dict})
     resp = UserResponseSchema(
         status="success", message=message, data=user_info
@@ -125,17 +253,59 @@ def get_user_and_access_token(user_dict: dict, message: str):
     return resp.model_dump(), access_token
 
 
+@app.get("/api/users/me", response_model=UserDetailSchema)
+@login_required
+def get_current_user_profile(request: Request):
+    """
+    answer from the profile snapshot in the token, the database is only
+    read when the snapshot is missing or stale
+    """
+    claims = JwtGenerator.get_token_claims(request.cookies.get("token"))
+    user_dict = profile_from_claims(claims)
+    if user_dict is None:
+        db_breaker.before_call()
+        user_id = request.user.username
+        with shard_router.user_session(user_id) as db:
+            user = user_by_id(db, user_id)
+            if not user:
+                return JSONResponse(
+                    status_code=404, content={"message": "User not found"}
+                )
+            note_profile_version(str(user.userId), user.version)
+            user_dict = user.to_dict()
+    user_info = UserDataSchema(**user_dict)
+    return UserDetailSchema(
+        status="success", message="User found", data=user_info
+    ).model_dump()
+
+
 @app.get("/api/users/{id}", response_model=UserDetailSchema)
 @login_required
-def get_user(request: Request, id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.userId == id).first()
+def get_user(
+    request: Request, id: str, response: Response, db: Session = Depends(get_db)
+):
+    if_none_match = request.headers.get("if-none-match")
+    with shard_router.user_session(id, db) as user_db:
+        if if_none_match:
+            row = user_version(user_db, id)
+            etag = make_etag(*row) if row else None
+            if etag and etag_matches(if_none_match, etag):
+                db.close()
+                return Response(
+                    status_code=status.HTTP_304_NOT_MODIFIED,
+                    headers={"ETag": etag},
+                )
+        user = user_by_id(user_db, id)
+        user_dict = user.to_dict() if user else None
     if user:
-        user_dict = user.to_dict()
+        response.headers["ETag"] = make_etag(user.userId, user.version)
+        note_profile_version(str(user.userId), user.version)
         user_info = UserDataSchema(**user_dict)
-        response = UserDetailSchema(
+        user_response = UserDetailSchema(
             status="success", message="User found", data=user_info
         ).model_dump()
-        return response
+        stale_cache.set(stale_key(request), user_response)
+        return user_response
     db.close()
     return JSONResponse(status_code=404, content={"message": "User not found"})
 
@@ -143,25 +313,47 @@ def get_user(request: Request, id: str, db: Session = Depends(get_db)):
 @app.get("/api/organisations", response_model=UserOrgResponseSchema)
 @login_required
 def get_all_user_organisaton(request: Request, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.userId == request.user.username).first()
-    if not user:
-        return JSONResponse(
-            status_code=404, content={"message": "user not found"}
-        )
-
     user_org = UserOrgSchema(
         organisations=[
             OrgSchema(
                 orgId=str(org.orgId),
                 name=org.name,
                 description=org.description,
+                member_count=org.member_count,
             )
-            for org in user.organizations
+            for org in orgs_for_user(db, request.user.username)
         ]
     )
     response = UserOrgResponseSchema(
         status="success", message="organization fetched", data=user_org
     )
+    stale_cache.set(stale_key(request), response.model_dump())
+    db.close()
+    return response
+
+
+@app.get(
+    "/api/organisations/search", response_model=OrgSearchResponseSchema
+)
+@login_required
+def search_organisations(
+    request: Request,
+    q: Annotated[str, Query(min_length=1, max_length=50)],
+    limit: Annotated[
+        int, Query(ge=1, le=settings.org_search_max_limit)
+    ] = 10,
+    db: Session = Depends(get_db),
+):
+    """
+    prefix search over organisation names, also tells if ``q`` is taken
+    """
+    orgs = [OrgSchema(**org.to_dict()) for org in search_orgs(db, q, limit)]
+    available = not (orgs and orgs[0].name.lower() == q.lower())
+    response = OrgSearchResponseSchema(
+        status="success",
+        message="organizations found",
+        data=OrgSearchSchema(available=available, organisations=orgs),
+    )
     db.close()
     return response
 
@@ -169,14 +361,25 @@ def get_all_user_organisaton(request: Request, db: Session = Depends(get_db)):
 @app.get("/api/organisations/{orgId}", response_model=OrgResponseSchema)
 @login_required
 def get_single_organisation(
-    request: Request, orgId: str, db: Session = Depends(get_db)
+    request: Request,
+    orgId: str,
+    response: Response,
+    db: Session = Depends(get_db),
 ):
     """
     get a single organization user is associated with
     """
-    user_org = (
-        db.query(Organization).filter(Organization.orgId == orgId).first()
-    )
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        row = org_version(db, orgId)
+        etag = make_etag(*row) if row else None
+        if etag and etag_matches(if_none_match, etag):
+            db.close()
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED,
+                headers={"ETag": etag},
+            )
+    user_org = org_by_id(db, orgId)
     if not user_org:
         content = {
             "status": "Bad request",
@@ -186,11 +389,51 @@ def get_single_organisation(
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND, content=content
         )
+    response.headers["ETag"] = make_etag(user_org.orgId, user_org.version)
     user_dict = user_org.to_dict()
     user_org = OrgSchema(**user_dict)
-    response = OrgResponseSchema(
+    org_response = OrgResponseSchema(
         status="success", message="Organization found", data=user_dict
     )
+    stale_cache.set(stale_key(request), org_response.model_dump())
+    db.close()
+    return org_response
+
+
+@app.post("/api/batch", response_model=BatchReadResponseSchema)
+@login_required
+def batch_read(
+    request: Request, batch: BatchReadSchema, db: Session = Depends(get_db)
+):
+    """
+    resolve many users and organisations with one query per kind
+    """
+    users = {user_id: BatchUserSchema(found=False) for user_id in batch.userIds}
+    user_ids = parse_uuids(batch.userIds)
+    # one query per shard holding any of the users
+    for shard, shard_ids in shard_router.group_by_shard(user_ids).items():
+        with shard_router.session(shard, db) as user_db:
+            for user in users_by_ids(user_db, shard_ids):
+                requested_ids = user_ids[user.userId]
+                found = BatchUserSchema(
+                    found=True, data=UserDataSchema(**user.to_dict())
+                )
+                for requested_id in requested_ids:
+                    users[requested_id] = found
+
+    orgs = {org_id: BatchOrgSchema(found=False) for org_id in batch.orgIds}
+    org_ids = parse_uuids(batch.orgIds)
+    if org_ids:
+        for org in orgs_by_ids(db, org_ids):
+            found = BatchOrgSchema(found=True, data=OrgSchema(**org.to_dict()))
+            for requested_id in org_ids[org.orgId]:
+                orgs[requested_id] = found
+
+    response = BatchReadResponseSchema(
+        status="success",
+        message="Batch resolved",
+        data=BatchReadDataSchema(users=users, organisations=orgs),
+    )
     db.close()
     return response
 
@@ -205,26 +448,37 @@ def create_organization(
     """
     create user organization
     """
-    existing_org = (
-        db.query(Organization).filter(Organization.name == org.name).first()
-    )
+    detail = {
+        "status": "Unsuccessful request",
+        "message": "Client error",
+        "statusCode": 400,
+    }
+    existing_org = org_by_name(db, org.name)
     if existing_org:
-        detail = {
-            "status": "Unsuccessful request",
-            "message": "Client error",
-            "statusCode": 400,
-        }
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST, content=detail
         )
-    user = db.query(User).filter(User.userId == request.user.username).first()
     add_org = Organization(name=org.name, description=org.description)
-    add_org.users.append(user)
     db.add(add_org)
+    try:
+        db.flush()
+    except IntegrityError:
+        # another request created the same name since the check above
+        db.rollback()
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST, content=detail
+        )
+    add_member(db, add_org.orgId, as_uuid(request.user.username))
     db.commit()
     db.refresh(add_org)
 
     org_dict = add_org.to_dict()
+    audit_log.record(
+        "organization.created",
+        actor_id=request.user.username,
+        subject_id=org_dict["orgId"],
+        name=org_dict["name"],
+    )
     added_org = OrgSchema(**org_dict)
     response = OrgResponseSchema(
         status="Success",
@@ -240,9 +494,12 @@ def create_organization(
     response_model=UserOrganizationSchemaResponse,
 )
 def add_user_to_organisation(
-    orgId: str, user: UserOrganizationSchema, db: Session = Depends(get_db)
+    request: Request,
+    orgId: str,
+    user: UserOrganizationSchema,
+    db: Session = Depends(get_db),
 ):
-    org = db.query(Organization).filter(Organization.orgId == orgId).first()
+    org = org_by_id(db, orgId)
     if not org:
         content = {
             "status": "Bad Request",
@@ -252,7 +509,8 @@ def add_user_to_organisation(
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND, content=content
         )
-    user_exist = db.query(User).filter(User.userId == user.userId).first()
+    with shard_router.user_session(user.userId, db) as user_db:
+        user_exist = user_by_id(user_db, user.userId)
     if not user_exist:
         content = {
             "status": "Bad Request",
@@ -263,8 +521,22 @@ def add_user_to_organisation(
             status_code=status.HTTP_404_NOT_FOUND, content=content
         )
 
-    org.users.append(user_exist)
-    db.commit()
+    # concurrent adds share one transaction, see MembershipBatcher, the
+    # pooled connection is handed back first so the batch can use it
+    org_id, user_id = org.orgId, user_exist.userId
+    db.close()
+    added = membership_batcher.add(org_id, user_id)
+    if added:
+        audit_log.record(
+            "organization.member_added",
+            actor_id=(
+                request.user.username
+                if request.user.is_authenticated
+                else None
+            ),
+            subject_id=orgId,
+            user_id=user.userId,
+        )
     response = UserOrganizationSchemaResponse(
         status="success", message="User added to organisation successfully"
     )
@@ -287,3 +559,30 @@ def custom_request_validation_error(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
         content={"errors": error},
     )
+
+
+@app.exception_handler(DatabaseUnavailable)
+@app.exception_handler(OperationalError)
+@app.exception_handler(PoolTimeoutError)
+def database_unavailable_error(request: Request, exc: Exception):
+    """
+    serve the last good response for reads while the database is down
+    """
+    if isinstance(exc, PoolTimeoutError):
+        db_breaker.record_failure()
+    if request.method == "GET":
+        content = stale_cache.get(stale_key(request))
+        if content is not None:
+            return JSONResponse(
+                status_code=200, content=content, headers={"X-Cache": "STALE"}
+            )
+    content = {
+        "status": "Service Unavailable",
+        "message": "Database unavailable",
+        "statusCode": 503,
+    }
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=content,
+        headers={"Retry-After": str(int(db_breaker.reset_seconds))},
+    )
@@ -0,0 +1,213 @@
+import threading
+import time
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import SessionLocal
+from app.models import Organization, association_table
+
+
+def _bump_member_count(db: Session, org_id, delta: int):
+    db.execute(
+        update(Organization)
+        .where(Organization.orgId == org_id)
+        .values(
+            member_count=Organization.member_count + delta,
+            version=Organization.version + 1,
+        )
+    )
+
+
+def add_member(db: Session, org_id, user_id) -> bool:
+    """
+    add a user to an organisation and bump its member count in the same
+    transaction, returns False when the user is already a member
+    """
+    inserted = db.execute(
+        insert(association_table)
+        .values(user_id=user_id, org_id=org_id)
+        .on_conflict_do_nothing()
+        .returning(association_table.c.org_id)
+    ).first()
+    if inserted is None:
+        return False
+    _bump_member_count(db, org_id, 1)
+    return True
+
+
+def add_members(db: Session, members: Iterable[Tuple]) -> Set[Tuple]:
+    """
+    add many (org_id, user_id) pairs with one multi-row insert and one count
+    update per organisation, returns the pairs that were new
+    """
+    rows = [
+        {"org_id": org_id, "user_id": user_id} for org_id, user_id in members
+    ]
+    inserted = db.execute(
+        insert(association_table)
+        .values(rows)
+        .on_conflict_do_nothing()
+        .returning(association_table.c.org_id, association_table.c.user_id)
+    ).all()
+    added = Counter(org_id for org_id, _ in inserted)
+    # a fixed order keeps concurrent batches from deadlocking on the rows
+    for org_id in sorted(added, key=str):
+        _bump_member_count(db, org_id, added[org_id])
+    return {(org_id, user_id) for org_id, user_id in inserted}
+
+
+def write_members(members: List[Tuple]) -> Set[Tuple]:
+    with SessionLocal() as db:
+        added = add_members(db, members)
+        db.commit()
+    return added
+
+
+class PendingMember:
+    def __init__(self, org_id, user_id):
+        self.key = (org_id, user_id)
+        self.done = False
+        self.added = False
+        self.error: Optional[Exception] = None
+
+
+class MembershipBatcher:
+    """
+    group commit for membership writes, the first waiting caller leads and
+    writes everything queued in one transaction while later callers wait
+    for their own result, a lone write goes straight to the database
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[Tuple]], Set[Tuple]] = write_members,
+        window: float = settings.membership_batch_seconds,
+        max_size: int = settings.membership_batch_size,
+    ):
+        self.write = write
+        self.window = window
+        self.max_size = max_size
+        self.batches = 0
+        self._pending: List[PendingMember] = []
+        self._leading = False
+        self._last_batch_size = 0
+        self._cond = threading.Condition()
+
+    def add(self, org_id, user_id) -> bool:
+        """
+        add a user to an organisation, returns False when already a member
+        """
+        item = PendingMember(org_id, user_id)
+        with self._cond:
+            self._pending.append(item)
+            if len(self._pending) >= self.max_size:
+                self._cond.notify_all()
+        while True:
+            batch = self._next_batch(item)
+            if batch is None:
+                break
+            try:
+                self._write(batch)
+            finally:
+                with self._cond:
+                    for pending in batch:
+                        pending.done = True
+                    self._leading = False
+                    self._cond.notify_all()
+        if item.error is not None:
+            raise item.error
+        return item.added
+
+    def _next_batch(self, item: PendingMember):
+        """
+        wait until ``item`` is written or this caller may lead the next batch
+        """
+        with self._cond:
+            while not item.done and self._leading:
+                self._cond.wait()
+            if item.done:
+                return None
+            self._leading = True
+            # only wait for company when writes are already arriving together
+            if len(self._pending) > 1 or self._last_batch_size > 1:
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            batch = self._pending[: self.max_size]
+            del self._pending[: self.max_size]
+            self._last_batch_size = len(batch)
+            self.batches += 1
+            return batch
+
+    def _write(self, batch: List[PendingMember]):
+        members = list(dict.fromkeys(item.key for item in batch))
+        try:
+            added = self.write(members)
+        except (IntegrityError, DataError) as error:
+            if len(members) == 1:
+                self._fail(batch, members, error)
+                return
+            # one bad row fails the whole statement, write them one by one
+            added = set()
+            for index, member in enumerate(members):
+                try:
+                    added |= self.write([member])
+                except (IntegrityError, DataError) as error:
+                    self._fail(batch, [member], error)
+                except Exception as error:
+                    # rows already written stand, the rest fail with this
+                    self._fail(batch, members[index:], error)
+                    break
+        except Exception as error:
+            self._fail(batch, members, error)
+            return
+        for item in batch:
+            # the first request for a pair gets the insert, repeats see a member
+            if item.key in added:
+                item.added = True
+                added.discard(item.key)
+
+    @staticmethod
+    def _fail(batch: List[PendingMember], members: List[Tuple], error):
+        members = set(members)
+        for item in batch:
+            if item.key in members:
+                item.error = error
+
+
+membership_batcher = MembershipBatcher()
+
+
+def reconcile_member_counts(db: Session) -> int:
+    """
+    recompute every member count from the association table in one
+    statement, returns how many organisations were corrected
+    """
+    actual = (
+        select(func.count())
+        .where(association_table.c.org_id == Organization.orgId)
+        .scalar_subquery()
+    )
+    result = db.execute(
+        update(Organization)
+        .where(Organization.member_count != actual)
+        .values(member_count=actual, version=Organization.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
+if __name__ == "__main__":
+    with SessionLocal() as db:
+        fixed = reconcile_member_counts(db)
+    print(f"reconciled member counts for {fixed} organisations")
@@ -1,16 +1,31 @@
 from uuid import uuid4
 
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Table
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Table,
+    UniqueConstraint,
+    event,
+    func,
+)
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.orm import object_session, relationship
 
 
 from app.db import Base
+
 association_table = Table(
     "association",
     Base.metadata,
-    Column("user_id", ForeignKey("user.userId")),
-    Column("org_id", ForeignKey("organization.orgId")),
+    # no foreign key, users may live on another shard (see app.sharding)
+    Column("user_id", UUID(as_uuid=True)),
+    Column("org_id", ForeignKey("organization.orgId"), index=True),
+    UniqueConstraint("user_id", "org_id", name="uq_association_user_org"),
 )
 
 
@@ -28,9 +43,16 @@ class User(Base):
     email = Column(String(100), nullable=False, unique=True)
     password = Column(String(100), nullable=False)
     phone = Column(String(50))
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
+    # only usable while users live on the primary, routes go through
+    # app.queries.orgs_for_user instead
     organizations = relationship(
-        "Organization", secondary=association_table, back_populates="users"
+        "Organization",
+        secondary=association_table,
+        primaryjoin="User.userId == foreign(association.c.user_id)",
+        secondaryjoin="Organization.orgId == foreign(association.c.org_id)",
+        back_populates="users",
     )
 
     def to_dict(self):
@@ -57,8 +79,27 @@ class Organization(Base):
     )
     name = Column(String(50), nullable=False)
     description = Column(String(500), nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # kept in step with the association table by app.membership
+    member_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
     users = relationship(
-        "User", secondary=association_table, back_populates="organizations"
+        "User",
+        secondary=association_table,
+        primaryjoin="Organization.orgId == foreign(association.c.org_id)",
+        secondaryjoin="User.userId == foreign(association.c.user_id)",
+        back_populates="organizations",
+    )
+
+    __table_args__ = (
+        # case-insensitive unique names, the "C" collation lets the same
+        # index serve ``LIKE 'prefix%'`` searches in index order
+        Index(
+            "ix_organization_name_lower",
+            func.lower(name).collate("C"),
+            unique=True,
+        ),
     )
 
     def to_dict(self):
@@ -71,3 +112,45 @@ class Organization(Base):
 
     def __str__(self):
         return self.name
+
+
+class UserDirectory(Base):
+    """
+    email to userId on the primary, the shard follows from the userId
+    """
+
+    __tablename__ = "user_directory"
+    email = Column(String(100), primary_key=True)
+    userId = Column(UUID(as_uuid=True), nullable=False, unique=True)
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_token"
+    jti = Column(String(64), primary_key=True)
+    # token expiry as a unix timestamp, rows past it can be pruned
+    expires_at = Column(Integer, nullable=False)
+    revoked_at = Column(
+        DateTime, nullable=False, server_default=func.now(), index=True
+    )
+
+
+class AuditEvent(Base):
+    __tablename__ = "audit_event"
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String(50), nullable=False, index=True)
+    actor_id = Column(String(64), nullable=True, index=True)
+    subject_id = Column(String(64), nullable=True)
+    details = Column(JSONB, nullable=False, default=dict)
+    # when the event happened, not when the batch was flushed
+    created_at = Column(DateTime, nullable=False)
+
+
+@event.listens_for(User, "before_update")
+@event.listens_for(Organization, "before_update")
+def bump_version(mapper, connection, target):
+    """
+    bump the row version whenever a column changes so old etags go stale
+    """
+    session = object_session(target)
+    if session.is_modified(target, include_collections=False):
+        target.version = type(target).version + 1
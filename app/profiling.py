@@ -0,0 +1,280 @@
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import jwt
+from jwt.exceptions import PyJWTError
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.auth import ALGORITHM, SECRET_KEY
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = str(Path(__file__).resolve().parent)
+PROFILE_HEADER = b"x-profile"
+# audience of profile tokens, access tokens carry none and are rejected
+PROFILE_AUDIENCE = "profile"
+# stacks ending in these files are threads parked on a lock or queue
+IDLE_FILES = ("threading.py", "queue.py")
+
+current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+def create_profile_token(
+    cpu: bool = False, expires_at: timedelta = timedelta(hours=1)
+) -> str:
+    """
+    signed value for the X-Profile header that turns profiling on for a request
+    """
+    data = {
+        "profile": True,
+        "cpu": cpu,
+        "aud": PROFILE_AUDIENCE,
+        "exp": datetime.now() + expires_at,
+    }
+    return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def profile_options(token: Optional[str]) -> Optional[dict]:
+    """
+    profiling options for a request, or None when it should not be profiled
+    """
+    if token:
+        try:
+            claims = jwt.decode(
+                token,
+                SECRET_KEY,
+                algorithms=[ALGORITHM],
+                audience=PROFILE_AUDIENCE,
+            )
+        except PyJWTError:
+            claims = {}
+        if claims.get("profile"):
+            return {"cpu": bool(claims.get("cpu"))}
+    if settings.profiling_enabled:
+        return {"cpu": settings.profiling_cpu}
+    return None
+
+
+def statement_shape(statement: str) -> str:
+    """
+    strip parameters from a statement so repeated queries compare equal
+    """
+    shape = re.sub(r"%\(\w+\)s|\$\d+|\?", "?", statement)
+    shape = re.sub(r"\((?:\s*\?\s*,)+\s*\?\s*\)", "(?...)", shape)
+    return re.sub(r"\s+", " ", shape).strip()
+
+
+class StackSampler:
+    """
+    sample the stacks of application threads into collapsed stack counts
+    """
+
+    def __init__(self, interval: float = settings.profiling_sample_interval):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or frame.f_code.co_filename.endswith(
+                IDLE_FILES
+            ):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            if any(APP_DIR in entry for entry in stack):
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="profile-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def dump(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w") as out:
+            for stack, count in self.stacks.most_common():
+                out.write(f"{stack} {count}\n")
+
+
+class RequestProfile:
+    """
+    sql statements and lazy loads issued while serving one request
+    """
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.duration = None
+        self.statements = []
+        self.lazy_loads = []
+
+    def record_statement(self, statement: str, duration: float):
+        self.statements.append((statement_shape(statement), duration))
+
+    def record_lazy_load(self, relationship: str):
+        self.lazy_loads.append(relationship)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started
+
+    def repeated_statements(
+        self, threshold: int = settings.profiling_repeat_threshold
+    ) -> dict:
+        """
+        statement shapes run at least ``threshold`` times, likely n+1 queries
+        """
+        counts = Counter(shape for shape, _ in self.statements)
+        return {shape: n for shape, n in counts.items() if n >= threshold}
+
+    def report(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "duration_ms": round((self.duration or 0) * 1000, 3),
+            "query_count": len(self.statements),
+            "query_ms": round(sum(d for _, d in self.statements) * 1000, 3),
+            "statements": [
+                {"sql": shape, "ms": round(d * 1000, 3)}
+                for shape, d in self.statements
+            ],
+            "repeated_statements": self.repeated_statements(),
+            "lazy_loads": dict(Counter(self.lazy_loads)),
+        }
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement_timer(conn, cursor, statement, parameters, context, many):
+    if current_profile.get() is not None:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_statement(conn, cursor, statement, parameters, context, many):
+    profile = current_profile.get()
+    started = conn.info.get("profile_started")
+    if profile is not None and started:
+        profile.record_statement(
+            statement, time.perf_counter() - started.pop()
+        )
+
+
+@event.listens_for(Session, "do_orm_execute")
+def record_lazy_load(orm_execute_state):
+    profile = current_profile.get()
+    if (
+        profile is not None
+        and orm_execute_state.is_relationship_load
+        and orm_execute_state.lazy_loaded_from is not None
+    ):
+        profile.record_lazy_load(
+            str(orm_execute_state.loader_strategy_path[-1])
+        )
+
+
+class ProfilingMiddleware:
+    """
+    profile requests when profiling is enabled in settings or the request
+    carries a signed X-Profile header
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = dict(scope["headers"]).get(PROFILE_HEADER)
+        options = profile_options(token.decode() if token else None)
+        if options is None:
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        sampler = StackSampler() if options["cpu"] else None
+        if sampler:
+            sampler.start()
+
+        async def send_with_summary(message):
+            if message["type"] == "http.response.start":
+                profile.finish()
+                summary = [
+                    (
+                        b"x-profile-queries",
+                        str(len(profile.statements)).encode(),
+                    ),
+                    (
+                        b"x-profile-repeated",
+                        str(len(profile.repeated_statements())).encode(),
+                    ),
+                    (
+                        b"x-profile-lazy-loads",
+                        str(len(profile.lazy_loads)).encode(),
+                    ),
+                ]
+                message["headers"] = list(message.get("headers", [])) + summary
+            await send(message)
+
+        reset_token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_summary)
+        finally:
+            current_profile.reset(reset_token)
+            profile.finish()
+            self.publish(profile, sampler)
+
+    def publish(
+        self, profile: RequestProfile, sampler: Optional[StackSampler]
+    ):
+        report = profile.report()
+        if sampler:
+            sampler.stop()
+            name = (
+                f"{datetime.now():%Y%m%d-%H%M%S-%f}-{profile.method}"
+                f"{profile.path.replace('/', '_')}.collapsed"
+            )
+            path = Path(settings.profiling_dump_dir) / name
+            sampler.dump(path)
+            report["cpu_profile"] = str(path)
+        level = (
+            logging.WARNING
+            if report["repeated_statements"] or report["lazy_loads"]
+            else logging.INFO
+        )
+        logger.log(level, "request profile: %s", json.dumps(report))
+
+
+if __name__ == "__main__":
+    print(create_profile_token(cpu="--cpu" in sys.argv))
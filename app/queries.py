@@ -0,0 +1,186 @@
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import any_, event, func, lambda_stmt, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.engine import Engine, default
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Organization, User, UserDirectory, association_table
+
+cache_counts = {"hits": 0, "misses": 0}
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def count_cache_hit(conn, cursor, statement, parameters, context, executemany):
+    if context is None:
+        return
+    if context.cache_hit is default.CACHE_HIT:
+        cache_counts["hits"] += 1
+    elif context.cache_hit is default.CACHE_MISS:
+        cache_counts["misses"] += 1
+
+
+def query_stats() -> dict:
+    """
+    compiled statement cache hits and misses for this worker
+    """
+    total = cache_counts["hits"] + cache_counts["misses"]
+    return {
+        "compiled_cache_hits": cache_counts["hits"],
+        "compiled_cache_misses": cache_counts["misses"],
+        "compiled_cache_hit_ratio": (
+            round(cache_counts["hits"] / total, 4) if total else None
+        ),
+        "prepare_threshold": settings.db_prepare_threshold,
+    }
+
+
+def as_uuid(value) -> Optional[UUID]:
+    """
+    invalid ids can never match a row, so they are not sent to postgres
+    """
+    if isinstance(value, UUID):
+        return value
+    try:
+        return UUID(str(value))
+    except ValueError:
+        return None
+
+
+def any_uuid(ids: Iterable[UUID]):
+    """
+    bind a list of uuids as a single array parameter for ``= ANY(...)``
+    """
+    return any_(literal(list(ids), ARRAY(PG_UUID(as_uuid=True))))
+
+
+# hot lookups are lambda statements: sqlalchemy caches them by code location
+# and skips rebuilding and re-compiling them, and the identical sql lets
+# psycopg turn them into server side prepared statements
+
+
+def user_by_email(db: Session, email: str) -> Optional[User]:
+    stmt = lambda_stmt(lambda: select(User).where(User.email == email))
+    return db.execute(stmt).scalars().first()
+
+
+def directory_user_id(db: Session, email: str) -> Optional[UUID]:
+    stmt = lambda_stmt(
+        lambda: select(UserDirectory.userId).where(
+            UserDirectory.email == email
+        )
+    )
+    return db.execute(stmt).scalar()
+
+
+def user_by_id(db: Session, user_id) -> Optional[User]:
+    user_id = as_uuid(user_id)
+    if user_id is None:
+        return None
+    stmt = lambda_stmt(lambda: select(User).where(User.userId == user_id))
+    return db.execute(stmt).scalars().first()
+
+
+def user_version(db: Session, user_id):
+    """
+    (userId, version) row for etag checks, without loading the user
+    """
+    user_id = as_uuid(user_id)
+    if user_id is None:
+        return None
+    stmt = lambda_stmt(
+        lambda: select(User.userId, User.version).where(User.userId == user_id)
+    )
+    return db.execute(stmt).first()
+
+
+def org_by_id(db: Session, org_id) -> Optional[Organization]:
+    org_id = as_uuid(org_id)
+    if org_id is None:
+        return None
+    stmt = lambda_stmt(
+        lambda: select(Organization).where(Organization.orgId == org_id)
+    )
+    return db.execute(stmt).scalars().first()
+
+
+def org_version(db: Session, org_id):
+    """
+    (orgId, version) row for etag checks, without loading the organisation
+    """
+    org_id = as_uuid(org_id)
+    if org_id is None:
+        return None
+    stmt = lambda_stmt(
+        lambda: select(Organization.orgId, Organization.version).where(
+            Organization.orgId == org_id
+        )
+    )
+    return db.execute(stmt).first()
+
+
+def org_by_name(db: Session, name: str) -> Optional[Organization]:
+    """
+    case-insensitive match served by the unique lower(name) index
+    """
+    name = name.lower()
+    stmt = lambda_stmt(
+        lambda: select(Organization).where(
+            func.lower(Organization.name).collate("C") == name
+        )
+    )
+    return db.execute(stmt).scalars().first()
+
+
+def search_orgs(db: Session, prefix: str, limit: int):
+    """
+    organisations whose name starts with ``prefix``, ignoring case
+    """
+    pattern = (
+        prefix.lower()
+        .replace("\\", "\\\\")
+        .replace("%", "\\%")
+        .replace("_", "\\_")
+    )
+    # same expression as the index, so the scan stops after ``limit`` rows
+    name_lower = func.lower(Organization.name).collate("C")
+    return db.execute(
+        select(Organization)
+        .where(name_lower.like(f"{pattern}%", escape="\\"))
+        .order_by(name_lower)
+        .limit(limit)
+    ).scalars()
+
+
+def users_by_ids(db: Session, user_ids: Iterable[UUID]):
+    return db.execute(
+        select(User).where(User.userId == any_uuid(user_ids))
+    ).scalars()
+
+
+def orgs_by_ids(db: Session, org_ids: Iterable[UUID]):
+    return db.execute(
+        select(Organization).where(Organization.orgId == any_uuid(org_ids))
+    ).scalars()
+
+
+def orgs_for_user(db: Session, user_id):
+    """
+    organisations a user belongs to, read from the primary without
+    touching the user's shard
+    """
+    user_id = as_uuid(user_id)
+    if user_id is None:
+        return []
+    stmt = lambda_stmt(
+        lambda: select(Organization)
+        .join(
+            association_table,
+            association_table.c.org_id == Organization.orgId,
+        )
+        .where(association_table.c.user_id == user_id)
+    )
+    return db.execute(stmt).scalars()
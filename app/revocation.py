@@ -0,0 +1,236 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+from math import ceil, log
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.breaker import DatabaseUnavailable, db_breaker
+from app.config import settings
+from app.db import SessionLocal
+from app.models import RevokedToken
+
+logger = logging.getLogger(__name__)
+
+# re-read rows revoked shortly before the last refresh so transactions
+# that committed late are not missed
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+
+class BloomFilter:
+    """
+    fixed size bloom filter over string keys
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [
+            (first + i * second) % self.size for i in range(self.hash_count)
+        ]
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        with self._lock:
+            new = False
+            for pos in positions:
+                if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                    self.bits[pos >> 3] |= 1 << (pos & 7)
+                    new = True
+            # keys seen again (refresh overlap) do not count towards capacity
+            if new:
+                self.count += 1
+
+    def update(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key)
+        )
+
+
+class RevocationList:
+    """
+    revoked token ids kept in the database, fronted by a per-worker bloom
+    filter so a token that was never revoked is accepted without any I/O
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        capacity: int = settings.revocation_capacity,
+        error_rate: float = settings.revocation_error_rate,
+        refresh_seconds: float = settings.revocation_refresh_seconds,
+        rebuild_seconds: float = settings.revocation_rebuild_seconds,
+    ):
+        self.session_factory = session_factory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self._bloom: Optional[BloomFilter] = None
+        self._last_seen = None
+        # ids revoked by this worker since the last rebuild started, so the
+        # next filter cannot miss them and they are rejected before any load
+        self._local: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def revoke(self, db: Session, jti: str, expires_at: int):
+        """
+        store a revoked token id and add it to this worker's filter
+        """
+        stmt = (
+            insert(RevokedToken)
+            .values(jti=jti, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=[RevokedToken.jti])
+        )
+        db.execute(stmt)
+        db.commit()
+        with self._lock:
+            self._local.add(jti)
+            if self._bloom is not None:
+                self._bloom.add(jti)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """
+        only ids the filter may contain are confirmed against the database,
+        a hit that cannot be confirmed counts as revoked
+        """
+        if not jti:
+            return False
+        bloom = self._bloom
+        if bloom is None:
+            # the background thread keeps retrying the load, until then
+            # only this worker's own revocations are known
+            if jti in self._local:
+                return True
+            logger.warning(
+                "revocation filter not loaded, token %s accepted", jti
+            )
+            return False
+        if jti not in bloom:
+            return False
+        try:
+            db_breaker.before_call()
+            with self.session_factory() as db:
+                expires_at = db.scalar(
+                    select(RevokedToken.expires_at).where(
+                        RevokedToken.jti == jti
+                    )
+                )
+        except (DatabaseUnavailable, SQLAlchemyError):
+            logger.warning("revocation check for %s failed, rejected", jti)
+            return True
+        return expires_at is not None
+
+    def rebuild(self) -> BloomFilter:
+        """
+        load every unexpired revocation into a freshly sized filter
+        """
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(RevokedToken.jti, RevokedToken.revoked_at).where(
+                    RevokedToken.expires_at > int(time.time())
+                )
+            ).all()
+        bloom = BloomFilter(max(self.capacity, 2 * len(rows)), self.error_rate)
+        bloom.update(jti for jti, _ in rows)
+        with self._lock:
+            bloom.update(self._local)
+            self._local.clear()
+            self._bloom = bloom
+            self._last_seen = max(
+                (revoked_at for _, revoked_at in rows), default=self._last_seen
+            )
+        return bloom
+
+    def refresh(self):
+        """
+        add revocations made by other workers since the last load
+        """
+        bloom = self._bloom
+        if bloom is None or self._last_seen is None:
+            self.rebuild()
+            return
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(RevokedToken.jti, RevokedToken.revoked_at).where(
+                    RevokedToken.revoked_at >= self._last_seen - REFRESH_OVERLAP
+                )
+            ).all()
+        bloom.update(jti for jti, _ in rows)
+        with self._lock:
+            self._last_seen = max(
+                (revoked_at for _, revoked_at in rows), default=self._last_seen
+            )
+        if bloom.count > self.capacity:
+            self.rebuild()
+
+    def prune(self):
+        """
+        delete revocations for tokens that have expired anyway
+        """
+        with self.session_factory() as db:
+            db.execute(
+                delete(RevokedToken).where(
+                    RevokedToken.expires_at <= int(time.time())
+                )
+            )
+            db.commit()
+
+    def _run(self):
+        last_rebuild = time.monotonic()
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                if time.monotonic() - last_rebuild >= self.rebuild_seconds:
+                    self.prune()
+                    self.rebuild()
+                    last_rebuild = time.monotonic()
+                else:
+                    self.refresh()
+            except Exception:
+                logger.exception("refreshing the revocation filter failed")
+
+    def start(self):
+        """
+        load the filter and keep it fresh from a background thread
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("loading the revocation filter failed")
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="revocation-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+
+revocation_list = RevocationList()
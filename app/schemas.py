@@ -9,7 +9,8 @@ from pydantic import (
     model_validator,
 )
 
-from app.validators import validate_field
+from app.config import settings
+from app.validators import USER_FIELD_RULES, validate_field, validate_rule
 
 
 class UserBaseSchema(BaseModel):
@@ -18,6 +19,11 @@ class UserBaseSchema(BaseModel):
     email: EmailStr
     phone: str
 
+    @field_validator(*USER_FIELD_RULES)
+    @classmethod
+    def check_field_rules(cls, value: str, info) -> str:
+        return validate_rule(USER_FIELD_RULES[info.field_name], value)
+
 
 class UserPostSchema(UserBaseSchema):
     password: str
@@ -68,6 +74,7 @@ class OrgSchema(BaseModel):
     orgId: str
     name: str
     description: Optional[str] = ""
+    member_count: int = 0
 
 
 class OrgResponseSchema(BaseModel):
@@ -86,6 +93,17 @@ class UserOrgResponseSchema(BaseModel):
     data: UserOrgSchema
 
 
+class OrgSearchSchema(BaseModel):
+    available: bool
+    organisations: List[OrgSchema] = []
+
+
+class OrgSearchResponseSchema(BaseModel):
+    status: str
+    message: str
+    data: OrgSearchSchema
+
+
 class UserOrganizationSchema(BaseModel):
     userId: str
 
@@ -93,3 +111,38 @@ class UserOrganizationSchema(BaseModel):
 class UserOrganizationSchemaResponse(BaseModel):
     status: str
     message: str
+
+
+# batch read schema
+class BatchReadSchema(BaseModel):
+    userIds: List[str] = []
+    orgIds: List[str] = []
+
+    @model_validator(mode="after")
+    def check_batch_size(self):
+        if len(self.userIds) + len(self.orgIds) > settings.batch_max_ids:
+            raise ValueError(
+                f"at most {settings.batch_max_ids} ids can be requested at once"
+            )
+        return self
+
+
+class BatchUserSchema(BaseModel):
+    found: bool
+    data: Optional[UserDataSchema] = None
+
+
+class BatchOrgSchema(BaseModel):
+    found: bool
+    data: Optional[OrgSchema] = None
+
+
+class BatchReadDataSchema(BaseModel):
+    users: Dict[str, BatchUserSchema] = {}
+    organisations: Dict[str, BatchOrgSchema] = {}
+
+
+class BatchReadResponseSchema(BaseModel):
+    status: str
+    message: str
+    data: BatchReadDataSchema
@@ -0,0 +1,262 @@
+import bisect
+import hashlib
+import sys
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+from uuid import UUID
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.config import settings
+from app.db import Base, SessionLocal, engine, make_engine
+from app.models import User, UserDirectory
+from app.queries import any_uuid, as_uuid, directory_user_id, user_by_email
+
+PRIMARY_SHARD = "primary"
+# users read per query while rebalancing
+REBALANCE_BATCH = 1000
+
+
+def ring_hash(key: str) -> int:
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing:
+    """
+    consistent hash ring over shard names, every shard owns many virtual
+    nodes so adding one only moves about 1/n of the keys
+    """
+
+    def __init__(
+        self,
+        names: Iterable[str],
+        virtual_nodes: int = settings.shard_virtual_nodes,
+    ):
+        points = sorted(
+            (ring_hash(f"{name}#{i}"), name)
+            for name in names
+            for i in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def get(self, key: str) -> str:
+        index = bisect.bisect(self._points, ring_hash(key))
+        return self._names[index % len(self._names)]
+
+
+class ShardRouter:
+    """
+    routes user rows to one of the configured databases by userId,
+    organisations, membership and the email directory stay on the primary
+    """
+
+    def __init__(self, engines: Dict[str, Engine], legacy_scan: bool = False):
+        self.engines = engines
+        # search every shard for emails missing from the directory
+        self.legacy_scan = legacy_scan
+        self._sessions = {
+            name: sessionmaker(
+                autocommit=False, autoflush=False, bind=shard_engine
+            )
+            for name, shard_engine in engines.items()
+        }
+        self.ring = HashRing(engines)
+
+    def shard_for(self, user_id) -> str:
+        key = as_uuid(user_id)
+        return self.ring.get(str(key) if key else str(user_id))
+
+    @contextmanager
+    def session(
+        self, shard: str, db: Optional[Session] = None
+    ) -> Iterator[Session]:
+        """
+        a session on ``shard``, ``db`` is reused when it is bound there
+        """
+        if db is not None and db.get_bind() is self.engines[shard]:
+            yield db
+            return
+        with self._sessions[shard]() as session:
+            yield session
+
+    def user_session(self, user_id, db: Optional[Session] = None):
+        return self.session(self.shard_for(user_id), db)
+
+    def group_by_shard(self, user_ids: Iterable) -> Dict[str, list]:
+        groups: Dict[str, list] = {}
+        for user_id in user_ids:
+            groups.setdefault(self.shard_for(user_id), []).append(user_id)
+        return groups
+
+    def create_tables(self):
+        for shard_engine in self.engines.values():
+            User.__table__.create(bind=shard_engine, checkfirst=True)
+
+
+def build_router() -> ShardRouter:
+    legacy_scan = settings.directory_legacy_scan
+    if not settings.user_shards:
+        return ShardRouter(
+            {PRIMARY_SHARD: engine},
+            legacy_scan=True if legacy_scan is None else legacy_scan,
+        )
+    return ShardRouter(
+        {name: make_engine(url) for name, url in settings.user_shards.items()},
+        legacy_scan=bool(legacy_scan),
+    )
+
+
+shard_router = build_router()
+
+
+def claim_email(db: Session, email: str, user_id) -> bool:
+    """
+    reserve ``email`` for ``user_id`` in the directory, returns False when
+    it is taken, the row stays locked until ``db`` commits
+    """
+    claimed = db.execute(
+        insert(UserDirectory)
+        .values(email=email, userId=user_id)
+        .on_conflict_do_nothing()
+        .returning(UserDirectory.userId)
+    ).first()
+    return claimed is not None
+
+
+def user_id_for_email(db: Session, email: str) -> Optional[UUID]:
+    """
+    one directory lookup, while the legacy scan is on users registered
+    before the directory existed are searched for on every shard
+    """
+    user_id = directory_user_id(db, email)
+    if user_id is not None or not shard_router.legacy_scan:
+        return user_id
+    for shard in shard_router.engines:
+        with shard_router.session(shard, db) as user_db:
+            user = user_by_email(user_db, email)
+            user_id = user.userId if user else None
+        if user_id is not None:
+            claim_email(db, email, user_id)
+            db.commit()
+            return user_id
+    return None
+
+
+def backfill_directory(db: Session, router: ShardRouter) -> int:
+    """
+    add directory rows for users that have none, returns how many
+    """
+    added = 0
+    for shard in router.engines:
+        with router.session(shard, db) as user_db:
+            rows = [
+                {"email": email, "userId": user_id}
+                for email, user_id in user_db.execute(
+                    select(User.email, User.userId)
+                )
+            ]
+        if rows:
+            result = db.execute(
+                insert(UserDirectory)
+                .on_conflict_do_nothing()
+                .returning(UserDirectory.email),
+                rows,
+            )
+            added += len(result.all())
+    db.commit()
+    return added
+
+
+def prepare_shards(db: Session, router: ShardRouter) -> int:
+    """
+    create the user table on every shard, drop the association foreign key
+    to the primary user table and fill the email directory
+    """
+    Base.metadata.create_all(bind=engine)
+    router.create_tables()
+    db.execute(
+        text(
+            "ALTER TABLE association "
+            "DROP CONSTRAINT IF EXISTS association_user_id_fkey"
+        )
+    )
+    return backfill_directory(db, router)
+
+
+def copy_users(db: Session, rows: List[dict]):
+    """
+    upsert user rows, a copy already on the shard is only replaced by a
+    version that is at least as new
+    """
+    table = User.__table__
+    stmt = insert(table)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[table.c.userId],
+            set_={
+                column.name: stmt.excluded[column.name]
+                for column in table.columns
+                if column.name != "userId"
+            },
+            where=table.c.version <= stmt.excluded.version,
+        ),
+        rows,
+    )
+
+
+def rebalance(router: ShardRouter, batch_size: int = REBALANCE_BATCH) -> int:
+    """
+    move users whose shard changed after a shard was added, reading each
+    shard in userId order one batch at a time, returns how many moved
+    """
+    moved = 0
+    table = User.__table__
+    for shard in router.engines:
+        last_id = None
+        while True:
+            with router.session(shard) as source:
+                stmt = select(table).order_by(table.c.userId).limit(batch_size)
+                if last_id is not None:
+                    stmt = stmt.where(table.c.userId > last_id)
+                rows = source.execute(stmt).mappings().all()
+                if not rows:
+                    break
+                last_id = rows[-1]["userId"]
+                targets: Dict[str, list] = {}
+                for row in rows:
+                    target = router.shard_for(row["userId"])
+                    if target != shard:
+                        targets.setdefault(target, []).append(dict(row))
+                for target, target_rows in targets.items():
+                    with router.session(target) as dest:
+                        copy_users(dest, target_rows)
+                        dest.commit()
+                    # the target now holds this row or a newer copy of it
+                    source.execute(
+                        delete(table).where(
+                            table.c.userId
+                            == any_uuid(row["userId"] for row in target_rows)
+                        )
+                    )
+                    source.commit()
+                    moved += len(target_rows)
+    return moved
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "prepare"
+    if command == "prepare":
+        with SessionLocal() as db:
+            added = prepare_shards(db, shard_router)
+        print(f"added {added} users to the email directory")
+        if shard_router.legacy_scan:
+            print("set DIRECTORY_LEGACY_SCAN=false to skip the login scan")
+    elif command == "rebalance":
+        print(f"moved {rebalance(shard_router)} users")
+    else:
+        sys.exit("usage: python -m app.sharding [prepare|rebalance]")
@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+
+from app.audit import AuditLog, email_digest
+from app.breaker import CircuitBreaker
+
+
+class FakeSession:
+    def __init__(self, written, fail=False):
+        self.written = written
+        self.fail = fail
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, stmt, events):
+        if self.fail:
+            raise ConnectionError("database down")
+        self.written.append(list(events))
+
+    def commit(self):
+        pass
+
+
+class TestAuditLog(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.failing = False
+        self.audit = AuditLog(
+            session_factory=lambda: FakeSession(self.batches, self.failing),
+            queue_size=100,
+            batch_size=50,
+            flush_seconds=0.05,
+        )
+
+    def test_events_are_written_in_batches(self):
+        self.audit.start()
+        for _ in range(120):
+            self.audit.record("user.login", actor_id="abc")
+        self.audit.stop()
+        self.assertEqual(sum(len(batch) for batch in self.batches), 120)
+        self.assertLess(len(self.batches), 120)
+
+    def test_record_without_worker_writes_inline(self):
+        self.audit.record("user.registered", actor_id="abc", source="test")
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(self.batches[0][0]["details"], {"source": "test"})
+
+    def test_failed_inline_write_is_retried(self):
+        self.failing = True
+        self.audit.record("user.login", actor_id="first")
+        self.failing = False
+        self.audit.record("user.login", actor_id="second")
+        actors = [event["actor_id"] for event in self.batches[0]]
+        self.assertEqual(actors, ["first", "second"])
+
+    def test_flush_thread_retries_spilled_events(self):
+        self.failing = True
+        self.audit.record("user.login", actor_id="first")
+        self.failing = False
+        self.audit.start()
+        self.audit.stop()
+        self.assertEqual(self.batches[0][0]["actor_id"], "first")
+
+    def test_open_breaker_spills_without_writing(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+        breaker.record_failure()
+        with mock.patch("app.audit.db_breaker", breaker):
+            self.audit.record("user.login", actor_id="abc")
+        self.assertEqual(self.batches, [])
+        self.assertEqual(len(self.audit._spill), 1)
+
+    def test_spill_drops_oldest_events_over_its_size(self):
+        self.audit.spill_size = 3
+        self.failing = True
+        for i in range(5):
+            self.audit.record("user.login", actor_id=f"user{i}")
+        actors = [event["actor_id"] for event in self.audit._spill]
+        self.assertEqual(actors, ["user2", "user3", "user4"])
+
+
+class TestEmailDigest(unittest.TestCase):
+    def test_digest_hides_and_normalises_email(self):
+        digest = email_digest("Someone@Example.com ")
+        self.assertNotIn("example", digest)
+        self.assertEqual(digest, email_digest("someone@example.com"))
@@ -0,0 +1,63 @@
+import unittest
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.main import app
+
+
+def register(client: TestClient) -> dict:
+    user = {
+        "first_name": "Ada",
+        "last_name": "Lovelace",
+        "email": f"{uuid4().hex}@example.com",
+        "password": "password123",
+        "phone": "1234567890",
+    }
+    response = client.post("/auth/register", json=user)
+    return response.json()["data"]
+
+
+class TestBatchRead(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        data = register(self.client)
+        self.user_id = data["user"]["userId"]
+        self.client.cookies.set("token", data["access_token"])
+
+    def batch(self, **ids):
+        return self.client.post("/api/batch", json=ids)
+
+    def test_found_and_not_found(self):
+        missing = str(uuid4())
+        response = self.batch(userIds=[self.user_id, missing])
+        self.assertEqual(response.status_code, 200)
+        users = response.json()["data"]["users"]
+        self.assertTrue(users[self.user_id]["found"])
+        self.assertEqual(users[self.user_id]["data"]["userId"], self.user_id)
+        self.assertFalse(users[missing]["found"])
+
+    def test_every_spelling_of_an_id_is_answered(self):
+        upper = self.user_id.upper()
+        users = self.batch(userIds=[self.user_id, upper]).json()["data"][
+            "users"
+        ]
+        self.assertTrue(users[self.user_id]["found"])
+        self.assertTrue(users[upper]["found"])
+
+    def test_invalid_ids_are_not_found(self):
+        response = self.batch(userIds=["not-a-uuid"], orgIds=["1"])
+        data = response.json()["data"]
+        self.assertFalse(data["users"]["not-a-uuid"]["found"])
+        self.assertFalse(data["organisations"]["1"]["found"])
+
+    def test_too_many_ids(self):
+        ids = [str(uuid4()) for _ in range(settings.batch_max_ids + 1)]
+        response = self.batch(userIds=ids)
+        self.assertEqual(response.status_code, 422)
+
+    def test_requires_login(self):
+        self.client.cookies.clear()
+        response = self.batch(userIds=[self.user_id])
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,45 @@
+import unittest
+
+from app.breaker import CircuitBreaker, DatabaseUnavailable, StaleCache
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(
+            failure_threshold=3, error_rate=0.5, window=4, reset_seconds=60
+        )
+
+    def test_trips_after_consecutive_failures(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(DatabaseUnavailable):
+            self.breaker.before_call()
+
+    def test_trips_on_error_rate(self):
+        for failed in (False, True, False, True):
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_single_probe_after_reset_timeout(self):
+        self.breaker.reset_seconds = 0
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+class TestStaleCache(unittest.TestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = StaleCache(max_size=2)
+        cache.set("a", {"n": 1})
+        cache.set("b", {"n": 2})
+        cache.get("a")
+        cache.set("c", {"n": 3})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), {"n": 1})
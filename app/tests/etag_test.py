@@ -0,0 +1,63 @@
+import unittest
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+def register(client: TestClient) -> dict:
+    user = {
+        "first_name": "Ada",
+        "last_name": "Lovelace",
+        "email": f"{uuid4().hex}@example.com",
+        "password": "password123",
+        "phone": "1234567890",
+    }
+    return client.post("/auth/register", json=user).json()["data"]
+
+
+class TestConditionalGet(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        data = register(self.client)
+        self.user_id = data["user"]["userId"]
+        self.client.cookies.set("token", data["access_token"])
+        response = self.client.post(
+            "/api/organisations",
+            json={"name": f"etag-{uuid4().hex}", "description": "d"},
+        )
+        self.org_id = response.json()["data"]["orgId"]
+
+    def assert_conditional_get(self, url: str) -> str:
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["etag"]
+        cached = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        self.assertEqual(cached.headers["etag"], etag)
+        return etag
+
+    def test_user_etag(self):
+        self.assert_conditional_get(f"/api/users/{self.user_id}")
+
+    def test_organisation_etag(self):
+        self.assert_conditional_get(f"/api/organisations/{self.org_id}")
+
+    def test_stale_etag_gets_full_response(self):
+        response = self.client.get(
+            f"/api/users/{self.user_id}", headers={"If-None-Match": '"old-0"'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["userId"], self.user_id)
+
+    def test_etag_changes_after_member_added(self):
+        url = f"/api/organisations/{self.org_id}"
+        etag = self.assert_conditional_get(url)
+        member = register(TestClient(app))["user"]["userId"]
+        self.client.post(f"{url}/users", json={"userId": member})
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["etag"], etag)
+        self.assertEqual(response.json()["data"]["member_count"], 2)
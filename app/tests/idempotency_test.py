@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+
+from app.idempotency import IdempotencyMiddleware
+
+
+class CountingApp:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        message = await receive()
+        await asyncio.sleep(0.01)
+        await send(
+            {"type": "http.response.start", "status": 201, "headers": []}
+        )
+        await send({"type": "http.response.body", "body": message["body"]})
+
+
+def post(
+    middleware, body: bytes, key: bytes = b"abc", path: str = "/auth/register"
+):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "headers": [(b"idempotency-key", key)],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await middleware(scope, receive, send)
+        return sent
+
+    return run()
+
+
+class TestIdempotencyMiddleware(unittest.TestCase):
+    def setUp(self):
+        self.app = CountingApp()
+        self.middleware = IdempotencyMiddleware(self.app)
+
+    def test_retry_is_replayed(self):
+        async def run():
+            first = await post(self.middleware, b"{}")
+            second = await post(self.middleware, b"{}")
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(self.app.calls, 1)
+        self.assertEqual(first[1]["body"], second[1]["body"])
+        self.assertIn((b"idempotent-replayed", b"true"), second[0]["headers"])
+
+    def test_concurrent_duplicates_wait(self):
+        async def run():
+            return await asyncio.gather(
+                *(post(self.middleware, b"{}") for _ in range(5))
+            )
+
+        responses = asyncio.run(run())
+        self.assertEqual(self.app.calls, 1)
+        self.assertTrue(all(r[0]["status"] == 201 for r in responses))
+
+    def test_key_reused_with_other_body(self):
+        async def run():
+            await post(self.middleware, b"{}")
+            return await post(self.middleware, b'{"other": 1}')
+
+        response = asyncio.run(run())
+        self.assertEqual(response[0]["status"], 422)
+
+    def test_login_is_never_replayed(self):
+        async def run():
+            await post(self.middleware, b"{}", path="/auth/login")
+            return await post(self.middleware, b"{}", path="/auth/login")
+
+        response = asyncio.run(run())
+        self.assertEqual(self.app.calls, 2)
+        self.assertNotIn(
+            (b"idempotent-replayed", b"true"), response[0]["headers"]
+        )
@@ -0,0 +1,38 @@
+import unittest
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+class TestLogout(unittest.TestCase):
+    def test_token_rejected_after_logout(self):
+        email = f"{uuid4().hex}@example.com"
+        user = {
+            "first_name": "Ada",
+            "last_name": "Lovelace",
+            "email": email,
+            "password": "password123",
+            "phone": "1234567890",
+        }
+        # entering the client runs the lifespan, which loads the filter
+        with TestClient(app) as client:
+            client.post("/auth/register", json=user)
+            response = client.post(
+                "/auth/login",
+                json={"email": email, "password": "password123"},
+            )
+            self.assertEqual(response.status_code, 200)
+            token = response.json()["data"]["access_token"]
+            client.cookies.set("token", token)
+            self.assertEqual(client.get("/api/organisations").status_code, 200)
+
+            self.assertEqual(client.post("/auth/logout").status_code, 200)
+            client.cookies.set("token", token)
+            response = client.get("/api/organisations")
+            self.assertEqual(response.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import threading
+import time
+import unittest
+
+from uuid import uuid4
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.db import Base, SessionLocal, engine
+from app.membership import (
+    MembershipBatcher,
+    PendingMember,
+    add_member,
+    add_members,
+    reconcile_member_counts,
+)
+from app.models import Organization
+
+
+class FakeWriter:
+    def __init__(self, delay: float = 0.01, bad=None, down_after_bad=False):
+        self.delay = delay
+        self.bad = bad
+        # every write after the bad row loses the connection
+        self.down_after_bad = down_after_bad
+        self.down = False
+        self.batches = []
+        self.members = set()
+
+    def __call__(self, members):
+        time.sleep(self.delay)
+        if self.down:
+            raise OperationalError("INSERT", {}, Exception("connection lost"))
+        if self.bad in members:
+            self.down = self.down_after_bad
+            raise IntegrityError("INSERT", {}, Exception("bad row"))
+        self.batches.append(members)
+        added = set(members) - self.members
+        self.members |= added
+        return added
+
+
+def add_concurrently(batcher, members):
+    results = {}
+
+    def add(index, member):
+        try:
+            results[index] = batcher.add(*member)
+        except (IntegrityError, OperationalError) as error:
+            results[index] = error
+
+    threads = [
+        threading.Thread(target=add, args=(index, member))
+        for index, member in enumerate(members)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [results[index] for index in range(len(members))]
+
+
+class TestMembershipBatcher(unittest.TestCase):
+    def test_concurrent_adds_share_batches(self):
+        writer = FakeWriter()
+        batcher = MembershipBatcher(writer, window=0.005, max_size=50)
+        members = [("org", f"user-{i}") for i in range(40)]
+        results = add_concurrently(batcher, members)
+        self.assertTrue(all(result is True for result in results))
+        self.assertEqual(writer.members, set(members))
+        self.assertLess(len(writer.batches), len(members) / 4)
+
+    def test_single_add_does_not_wait_for_window(self):
+        batcher = MembershipBatcher(FakeWriter(delay=0), window=5)
+        started = time.monotonic()
+        self.assertTrue(batcher.add("org", "user"))
+        self.assertFalse(batcher.add("org", "user"))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_duplicate_in_batch_is_added_once(self):
+        batcher = MembershipBatcher(FakeWriter(), window=0.005)
+        results = add_concurrently(batcher, [("org", "user")] * 5)
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(results.count(False), 4)
+
+    def test_bad_row_only_fails_its_own_request(self):
+        writer = FakeWriter(bad=("org", "user-3"))
+        batcher = MembershipBatcher(writer, window=0.005)
+        members = [("org", f"user-{i}") for i in range(8)]
+        results = add_concurrently(batcher, members)
+        self.assertIsInstance(results[3], IntegrityError)
+        self.assertEqual(
+            [r for i, r in enumerate(results) if i != 3], [True] * 7
+        )
+
+    def test_failed_retry_fails_unwritten_requests(self):
+        writer = FakeWriter(
+            delay=0, bad=("org", "user-1"), down_after_bad=True
+        )
+        batcher = MembershipBatcher(writer)
+        batch = [PendingMember("org", f"user-{i}") for i in range(4)]
+        batcher._write(batch)
+        self.assertEqual(writer.members, set())
+        # every row after the lost connection fails, none reports a member
+        for item in batch:
+            self.assertFalse(item.added)
+            self.assertIsInstance(item.error, OperationalError)
+
+
+class TestMemberCounts(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(bind=engine)
+
+    def setUp(self):
+        self.db = SessionLocal()
+        self.org = Organization(name=f"members-{uuid4().hex}")
+        self.db.add(self.org)
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+
+    def counts(self):
+        self.db.refresh(self.org)
+        return self.org.member_count, self.org.version
+
+    def test_add_bumps_count_and_version(self):
+        self.assertTrue(add_member(self.db, self.org.orgId, uuid4()))
+        self.db.commit()
+        self.assertEqual(self.counts(), (1, 2))
+
+    def test_duplicate_add_is_a_no_op(self):
+        user_id = uuid4()
+        add_member(self.db, self.org.orgId, user_id)
+        self.db.commit()
+        self.assertFalse(add_member(self.db, self.org.orgId, user_id))
+        self.db.commit()
+        self.assertEqual(self.counts(), (1, 2))
+
+    def test_add_many_counts_each_new_member_once(self):
+        user_id = uuid4()
+        members = [(self.org.orgId, user_id), (self.org.orgId, uuid4())]
+        added = add_members(self.db, members + members[:1])
+        self.db.commit()
+        self.assertEqual(added, set(members))
+        self.assertEqual(self.counts(), (2, 2))
+
+    def test_reconcile_fixes_drifted_count(self):
+        add_member(self.db, self.org.orgId, uuid4())
+        self.db.execute(
+            update(Organization)
+            .where(Organization.orgId == self.org.orgId)
+            .values(member_count=7)
+        )
+        self.db.commit()
+        self.assertGreaterEqual(reconcile_member_counts(self.db), 1)
+        self.assertEqual(self.counts()[0], 1)
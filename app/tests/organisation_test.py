@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+class TestOrganisationSearch(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        user = {
+            "first_name": "Ada",
+            "last_name": "Lovelace",
+            "email": f"{uuid4().hex}@example.com",
+            "password": "password123",
+            "phone": "1234567890",
+        }
+        data = self.client.post("/auth/register", json=user).json()["data"]
+        self.client.cookies.set("token", data["access_token"])
+        self.prefix = f"s{uuid4().hex[:10]}"
+
+    def create(self, name: str):
+        return self.client.post(
+            "/api/organisations", json={"name": name, "description": "d"}
+        )
+
+    def search(self, q: str, **params):
+        return self.client.get(
+            "/api/organisations/search", params={"q": q, **params}
+        )
+
+    def test_prefix_search_is_ordered_and_limited(self):
+        for suffix in ("c", "A", "b"):
+            self.create(f"{self.prefix}{suffix}")
+        response = self.search(self.prefix.upper(), limit=2)
+        self.assertEqual(response.status_code, 200)
+        names = [
+            org["name"] for org in response.json()["data"]["organisations"]
+        ]
+        self.assertEqual(names, [f"{self.prefix}A", f"{self.prefix}b"])
+
+    def test_available_flag(self):
+        self.create(f"{self.prefix}Team")
+        taken = self.search(f"{self.prefix}TEAM").json()["data"]
+        self.assertFalse(taken["available"])
+        free = self.search(f"{self.prefix}Tea").json()["data"]
+        self.assertTrue(free["available"])
+
+    def test_like_wildcards_are_literal(self):
+        self.create(f"{self.prefix}x")
+        data = self.search(f"{self.prefix[:4]}%").json()["data"]
+        self.assertEqual(data["organisations"], [])
+
+    def test_limit_is_capped(self):
+        response = self.search(self.prefix, limit=1000)
+        self.assertEqual(response.status_code, 422)
+
+    def test_name_taken_case_insensitively(self):
+        self.assertEqual(self.create(f"{self.prefix}Org").status_code, 201)
+        response = self.create(f"{self.prefix}ORG")
+        self.assertEqual(response.status_code, 400)
+
+    def test_concurrent_create_hits_unique_index(self):
+        self.assertEqual(self.create(f"{self.prefix}Race").status_code, 201)
+        # the other request passed the name check before this one committed
+        with mock.patch("app.main.org_by_name", return_value=None):
+            response = self.create(f"{self.prefix}race")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["message"], "Client error")
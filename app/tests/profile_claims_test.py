@@ -0,0 +1,49 @@
+import unittest
+from uuid import uuid4
+
+from app.auth import (
+    PROFILE_CLAIM,
+    PROFILE_SNAPSHOT_VERSION,
+    note_profile_version,
+    profile_claims,
+    profile_from_claims,
+)
+from app.main import get_user_and_access_token
+from app.profiling import profile_options
+
+
+class TestProfileClaims(unittest.TestCase):
+    def setUp(self):
+        self.user_id = str(uuid4())
+        self.user_dict = {
+            "userId": self.user_id,
+            "first_name": "Ann",
+            "last_name": "Lee",
+            "email": "ann@example.com",
+            "phone": "1234567890",
+            "version": 2,
+        }
+        self.claims = {
+            "userId": self.user_id,
+            PROFILE_CLAIM: profile_claims(self.user_dict),
+        }
+
+    def test_snapshot_round_trip(self):
+        user_dict = profile_from_claims(self.claims)
+        self.assertEqual(user_dict["first_name"], "Ann")
+        self.assertEqual(user_dict["userId"], self.user_id)
+
+    def test_newer_version_forces_fallback(self):
+        note_profile_version(self.user_id, 3)
+        self.assertIsNone(profile_from_claims(self.claims))
+
+    def test_unknown_snapshot_format_forces_fallback(self):
+        self.claims[PROFILE_CLAIM]["sv"] = PROFILE_SNAPSHOT_VERSION + 1
+        self.assertIsNone(profile_from_claims(self.claims))
+
+    def test_token_without_snapshot(self):
+        self.assertIsNone(profile_from_claims({"userId": self.user_id}))
+
+    def test_access_token_does_not_enable_profiling(self):
+        _, token = get_user_and_access_token(self.user_dict, "ok")
+        self.assertIsNone(profile_options(token))
@@ -0,0 +1,51 @@
+import unittest
+
+from app.auth import JwtGenerator
+from app.profiling import (
+    RequestProfile,
+    create_profile_token,
+    profile_options,
+    statement_shape,
+)
+
+
+class TestRequestProfile(unittest.TestCase):
+    def test_statement_shape_ignores_parameters(self):
+        first = statement_shape(
+            "SELECT * FROM organization\n WHERE name = %(name_1)s"
+        )
+        second = statement_shape(
+            "SELECT * FROM organization WHERE name = %(name_2)s"
+        )
+        self.assertEqual(first, second)
+        self.assertEqual(
+            statement_shape("SELECT 1 WHERE id IN (%(a)s, %(b)s, %(c)s)"),
+            "SELECT 1 WHERE id IN (?...)",
+        )
+
+    def test_repeated_statements_are_flagged(self):
+        profile = RequestProfile("GET", "/api/organisations")
+        for n in range(4):
+            profile.record_statement(
+                f'SELECT * FROM "user" WHERE "userId" = %(id_{n})s', 0.001
+            )
+        profile.record_statement("SELECT * FROM organization", 0.001)
+        repeated = profile.repeated_statements(threshold=3)
+        self.assertEqual(list(repeated.values()), [4])
+        self.assertEqual(profile.report()["query_count"], 5)
+
+
+class TestProfileToken(unittest.TestCase):
+    def test_profile_token_turns_profiling_on(self):
+        token = create_profile_token(cpu=True)
+        self.assertEqual(profile_options(token), {"cpu": True})
+
+    def test_access_token_is_not_a_profile_token(self):
+        token = JwtGenerator.create_access_token(
+            {"userId": "abc", "profile": {"sv": 1}}
+        )
+        self.assertIsNone(profile_options(token))
+
+    def test_profile_token_is_not_an_access_token(self):
+        token = create_profile_token()
+        self.assertIsNone(JwtGenerator.get_token_claims(token))
@@ -0,0 +1,62 @@
+import unittest
+from uuid import uuid4
+
+from app.db import Base, SessionLocal, engine
+from app.queries import (
+    as_uuid,
+    cache_counts,
+    org_by_id,
+    query_stats,
+    user_by_id,
+    user_version,
+)
+
+
+class NoQuerySession:
+    def execute(self, stmt):
+        raise AssertionError("invalid ids must not reach the database")
+
+
+class TestAsUuid(unittest.TestCase):
+    def test_valid_spellings(self):
+        user_id = uuid4()
+        self.assertEqual(as_uuid(user_id), user_id)
+        self.assertEqual(as_uuid(str(user_id)), user_id)
+        self.assertEqual(as_uuid(str(user_id).upper()), user_id)
+        self.assertEqual(as_uuid(user_id.hex), user_id)
+
+    def test_invalid_ids(self):
+        self.assertIsNone(as_uuid("not-a-uuid"))
+        self.assertIsNone(as_uuid(""))
+        self.assertIsNone(as_uuid(12))
+
+    def test_invalid_ids_do_not_query(self):
+        db = NoQuerySession()
+        self.assertIsNone(user_by_id(db, "nope"))
+        self.assertIsNone(user_version(db, "nope"))
+        self.assertIsNone(org_by_id(db, "nope"))
+
+
+class TestQueryStats(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        Base.metadata.create_all(bind=engine)
+
+    def test_repeated_lookup_is_a_cache_hit(self):
+        with SessionLocal() as db:
+            user_by_id(db, uuid4())
+            before = dict(cache_counts)
+            user_by_id(db, uuid4())
+        self.assertEqual(cache_counts["hits"], before["hits"] + 1)
+        self.assertEqual(cache_counts["misses"], before["misses"])
+
+    def test_hit_ratio(self):
+        stats = query_stats()
+        total = stats["compiled_cache_hits"] + stats["compiled_cache_misses"]
+        if total:
+            self.assertEqual(
+                stats["compiled_cache_hit_ratio"],
+                round(stats["compiled_cache_hits"] / total, 4),
+            )
+        else:
+            self.assertIsNone(stats["compiled_cache_hit_ratio"])
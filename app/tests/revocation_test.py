@@ -0,0 +1,70 @@
+import unittest
+from uuid import uuid4
+
+from sqlalchemy.exc import OperationalError
+
+from app.revocation import BloomFilter, RevocationList
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_added_keys_are_found(self):
+        bloom = BloomFilter(capacity=1000)
+        keys = [uuid4().hex for _ in range(1000)]
+        bloom.update(keys)
+        self.assertTrue(all(key in bloom for key in keys))
+        # a key whose bits were all set already is not counted
+        self.assertGreater(bloom.count, 990)
+        self.assertLessEqual(bloom.count, 1000)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        bloom.update(uuid4().hex for _ in range(1000))
+        false_positives = sum(uuid4().hex in bloom for _ in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_repeated_keys_are_counted_once(self):
+        bloom = BloomFilter(capacity=1000)
+        keys = [uuid4().hex for _ in range(100)]
+        bloom.update(keys)
+        bloom.update(keys)
+        self.assertEqual(bloom.count, 100)
+
+
+class FakeDb:
+    def execute(self, stmt):
+        pass
+
+    def commit(self):
+        pass
+
+
+class FailingSession:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        raise OperationalError("SELECT", {}, Exception("database down"))
+
+
+class TestRevocationList(unittest.TestCase):
+    def setUp(self):
+        self.session_factory = FailingSession()
+        self.revocations = RevocationList(session_factory=self.session_factory)
+
+    def test_unloaded_filter_does_not_query_on_request(self):
+        self.assertFalse(self.revocations.is_revoked(uuid4().hex))
+        self.assertEqual(self.session_factory.calls, 0)
+
+    def test_unconfirmed_hit_counts_as_revoked(self):
+        jti = uuid4().hex
+        self.revocations._bloom = BloomFilter(capacity=10)
+        self.revocations._bloom.add(jti)
+        self.assertTrue(self.revocations.is_revoked(jti))
+
+    def test_own_revocations_rejected_before_filter_loads(self):
+        jti = uuid4().hex
+        self.revocations.revoke(FakeDb(), jti, expires_at=0)
+        self.assertTrue(self.revocations.is_revoked(jti))
+        self.assertFalse(self.revocations.is_revoked(uuid4().hex))
+        self.assertEqual(self.session_factory.calls, 0)
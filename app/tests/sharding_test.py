@@ -0,0 +1,179 @@
+import unittest
+from unittest import mock
+from uuid import UUID, uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, select
+
+from app.config import settings
+from app.db import make_engine
+from app.main import app
+from app.models import User
+from app.sharding import (
+    HashRing,
+    ShardRouter,
+    copy_users,
+    rebalance,
+)
+
+
+class TestHashRing(unittest.TestCase):
+    def setUp(self):
+        self.keys = [str(uuid4()) for _ in range(2000)]
+
+    def test_keys_spread_over_shards(self):
+        ring = HashRing(["a", "b", "c"])
+        counts = {}
+        for key in self.keys:
+            shard = ring.get(key)
+            counts[shard] = counts.get(shard, 0) + 1
+        self.assertEqual(set(counts), {"a", "b", "c"})
+        self.assertTrue(all(count > 400 for count in counts.values()))
+
+    def test_adding_a_shard_moves_few_keys(self):
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "b", "c", "d"])
+        moved = [key for key in self.keys if before.get(key) != after.get(key)]
+        self.assertTrue(all(after.get(key) == "d" for key in moved))
+        self.assertLess(len(moved), len(self.keys) / 2)
+
+
+class TestShardRouter(unittest.TestCase):
+    def test_uuid_spellings_route_to_the_same_shard(self):
+        router = ShardRouter({"a": object(), "b": object()})
+        user_id = uuid4()
+        self.assertEqual(
+            router.shard_for(user_id), router.shard_for(str(user_id).upper())
+        )
+
+    def test_group_by_shard(self):
+        router = ShardRouter({"a": object(), "b": object()})
+        user_ids = [uuid4() for _ in range(50)]
+        groups = router.group_by_shard(user_ids)
+        self.assertEqual(
+            sorted(sum(groups.values(), []), key=str),
+            sorted(user_ids, key=str),
+        )
+        for shard, ids in groups.items():
+            self.assertTrue(all(router.shard_for(i) == shard for i in ids))
+
+
+@unittest.skipUnless(settings.test_user_shards, "TEST_USER_SHARDS not set")
+class TestShardedUsers(unittest.TestCase):
+    """
+    register, login and reads against two real shard databases
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.router = ShardRouter(
+            {
+                name: make_engine(url)
+                for name, url in settings.test_user_shards.items()
+            }
+        )
+        cls.router.create_tables()
+        cls.patches = [
+            mock.patch("app.main.shard_router", cls.router),
+            mock.patch("app.sharding.shard_router", cls.router),
+        ]
+        for patch in cls.patches:
+            patch.start()
+        cls.client = TestClient(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        for patch in cls.patches:
+            patch.stop()
+        for shard_engine in cls.router.engines.values():
+            shard_engine.dispose()
+
+    def setUp(self):
+        self.shard_queries = 0
+        for shard_engine in self.router.engines.values():
+            event.listen(shard_engine, "before_cursor_execute", self.count)
+
+    def tearDown(self):
+        for shard_engine in self.router.engines.values():
+            event.remove(shard_engine, "before_cursor_execute", self.count)
+
+    def count(self, *args):
+        self.shard_queries += 1
+
+    def register(self) -> dict:
+        user = {
+            "first_name": "Ada",
+            "last_name": "Lovelace",
+            "email": f"{uuid4().hex}@example.com",
+            "password": "password123",
+            "phone": "1234567890",
+        }
+        response = self.client.post("/auth/register", json=user)
+        self.assertEqual(response.status_code, 201)
+        return {**user, **response.json()["data"]["user"]}
+
+    def stored_on(self, user_id) -> list:
+        shards = []
+        for name, shard_engine in self.router.engines.items():
+            with shard_engine.connect() as conn:
+                row = conn.execute(
+                    select(User.userId).where(User.userId == UUID(user_id))
+                ).first()
+            if row:
+                shards.append(name)
+        return shards
+
+    def test_register_login_and_read(self):
+        users = [self.register() for _ in range(6)]
+        for user in users:
+            self.assertEqual(
+                self.stored_on(user["userId"]),
+                [self.router.shard_for(user["userId"])],
+            )
+        login = self.client.post(
+            "/auth/login",
+            json={"email": users[0]["email"], "password": "password123"},
+        )
+        self.assertEqual(login.status_code, 200)
+        self.client.cookies.set("token", login.cookies["token"])
+        for user in users:
+            response = self.client.get(f"/api/users/{user['userId']}")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["data"]["email"], user["email"])
+        user_ids = [user["userId"] for user in users]
+        batch = self.client.post(
+            "/api/batch", json={"userIds": user_ids + [str(uuid4())]}
+        ).json()["data"]["users"]
+        self.assertEqual(sum(found["found"] for found in batch.values()), 6)
+
+    def test_unknown_email_does_not_touch_shards(self):
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "nobody@example.com", "password": "password123"},
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.shard_queries, 0)
+
+    def test_rebalance_keeps_the_newer_copy(self):
+        user_id = uuid4()
+        while self.router.shard_for(user_id) != "b":
+            user_id = uuid4()
+        row = {
+            "userId": user_id,
+            "first_name": "Old",
+            "last_name": "Copy",
+            "email": f"{user_id.hex}@example.com",
+            "password": "x",
+            "phone": "123456",
+            "version": 1,
+        }
+        with self.router.session("a") as db:
+            copy_users(db, [row])
+            db.commit()
+        with self.router.session("b") as db:
+            copy_users(db, [{**row, "first_name": "New", "version": 2}])
+            db.commit()
+        rebalance(self.router, batch_size=2)
+        self.assertEqual(self.stored_on(str(user_id)), ["b"])
+        with self.router.session("b") as db:
+            self.assertEqual(db.get(User, user_id).first_name, "New")
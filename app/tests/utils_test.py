@@ -0,0 +1,34 @@
+import unittest
+from uuid import uuid4
+
+from app.utils import etag_matches, make_etag, parse_uuids
+
+
+class TestEtag(unittest.TestCase):
+    def setUp(self):
+        self.etag = make_etag(uuid4(), 3)
+
+    def test_matching_etag(self):
+        self.assertTrue(etag_matches(self.etag, self.etag))
+        self.assertTrue(etag_matches(f'"other", {self.etag}', self.etag))
+
+    def test_weak_and_wildcard_etag(self):
+        self.assertTrue(etag_matches(f"W/{self.etag}", self.etag))
+        self.assertTrue(etag_matches("*", self.etag))
+
+    def test_stale_etag(self):
+        self.assertFalse(etag_matches('"stale-1"', self.etag))
+        self.assertFalse(etag_matches(None, self.etag))
+
+
+class TestParseUuids(unittest.TestCase):
+    def test_invalid_ids_are_skipped(self):
+        user_id = str(uuid4())
+        parsed = parse_uuids([user_id, "not-a-uuid"])
+        self.assertEqual(list(parsed.values()), [[user_id]])
+
+    def test_every_spelling_is_kept(self):
+        user_id = str(uuid4())
+        parsed = parse_uuids([user_id, user_id.upper()])
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(list(parsed.values()), [[user_id, user_id.upper()]])
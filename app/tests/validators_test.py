@@ -0,0 +1,62 @@
+import unittest
+
+from pydantic import ValidationError
+
+from app.schemas import UserPostSchema
+from app.validators import RULES, validate_records
+
+USER = {
+    "first_name": "Mary-Jane",
+    "last_name": "O'Neil",
+    "email": "mary.jane@example.com",
+    "password": "password123",
+    "phone": "+234 904 156 3211",
+}
+
+
+class TestValidationRules(unittest.TestCase):
+    def test_rule_checks_return_messages(self):
+        self.assertIsNone(RULES["name"].check("Ann"))
+        self.assertIsNotNone(RULES["name"].check("R2D2"))
+        self.assertIsNotNone(RULES["phone"].check("call me"))
+
+    def test_schema_uses_rules(self):
+        UserPostSchema(**USER)
+        with self.assertRaises(ValidationError) as ctx:
+            UserPostSchema(**{**USER, "first_name": "R2D2", "phone": "x"})
+        fields = [err["loc"][0] for err in ctx.exception.errors()]
+        self.assertEqual(fields, ["first_name", "phone"])
+
+
+class TestValidateRecords(unittest.TestCase):
+    def test_errors_per_row(self):
+        rows = [USER, {**USER, "first_name": "1"}, {"first_name": "Ann"}]
+        errors = validate_records(rows)
+        self.assertEqual(errors[0], [])
+        self.assertEqual([err["fields"] for err in errors[1]], ["first_name"])
+        self.assertEqual(
+            [err["fields"] for err in errors[2]],
+            ["last_name", "email", "phone", "password"],
+        )
+        self.assertTrue(
+            all(err["message"] == "Field required" for err in errors[2])
+        )
+
+    def test_batch_agrees_with_schema(self):
+        rows = [
+            USER,
+            {**USER, "email": "not-an-email"},
+            {**USER, "email": "Mary <mary@example.com>"},
+            {**USER, "password": 123},
+            {key: value for key, value in USER.items() if key != "password"},
+            {**USER, "phone": "12"},
+        ]
+        for row, errors in zip(rows, validate_records(rows)):
+            try:
+                UserPostSchema(**row)
+                schema_fields = []
+            except ValidationError as error:
+                schema_fields = [err["loc"][0] for err in error.errors()]
+            self.assertEqual(
+                [err["fields"] for err in errors], schema_fields, row
+            )
@@ -1,3 +1,6 @@
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID
+
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
@@ -17,6 +20,41 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def parse_uuids(ids: Iterable[str]) -> Dict[UUID, List[str]]:
+    """
+    map each valid uuid to every id string the client sent for it, invalid
+    ids are skipped
+    """
+    parsed: Dict[UUID, List[str]] = {}
+    for raw_id in ids:
+        try:
+            key = UUID(raw_id)
+        except ValueError:
+            continue
+        parsed.setdefault(key, []).append(raw_id)
+    return parsed
+
+
+def make_etag(key, version: int) -> str:
+    """
+    build a strong etag from a row id and its version
+    """
+    return f'"{key}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    check an If-None-Match header against the current etag
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
 post_response = {
     201: {
         "description": "Successful  registration response",
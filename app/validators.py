@@ -1,9 +1,18 @@
 import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Mapping, Optional
 
+from pydantic.networks import validate_email
+from pydantic_core import PydanticCustomError
+
+
+@lru_cache(maxsize=128)
+def compile_pattern(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
 
 
 def regex_validator(pattern: str, string: str):
-    return re.match(pattern, string) or None
+    return compile_pattern(pattern).match(string) or None
 
 
 
@@ -16,3 +25,115 @@ def validate_field(field_name: str, error_msg: str = '', pattern: str = '') -> s
 
     return field_name
 
+
+class ValidationRule:
+    """
+    a named pattern compiled once, checking a value returns the error
+    message instead of raising so batches stay cheap
+    """
+
+    def __init__(self, name: str, pattern: str, error_msg: str):
+        self.name = name
+        self.pattern = compile_pattern(pattern)
+        self.error_msg = error_msg
+        self._match = self.pattern.fullmatch
+
+    def check(self, value) -> Optional[str]:
+        if isinstance(value, str) and self._match(value):
+            return None
+        return self.error_msg
+
+
+class EmailRule(ValidationRule):
+    """
+    the check pydantic's EmailStr runs, too involved for a single pattern
+    """
+
+    def __init__(self, name: str, error_msg: str):
+        self.name = name
+        self.error_msg = error_msg
+
+    def check(self, value) -> Optional[str]:
+        if not isinstance(value, str):
+            return self.error_msg
+        try:
+            validate_email(value)
+        except PydanticCustomError:
+            return self.error_msg
+        return None
+
+
+RULES: Dict[str, ValidationRule] = {}
+
+
+def register_rule(name: str, pattern: str, error_msg: str) -> ValidationRule:
+    rule = ValidationRule(name, pattern, error_msg)
+    RULES[name] = rule
+    return rule
+
+
+register_rule(
+    "name",
+    r"(?=.{1,100}$)[^\W\d_]+(?:[ '.-]+[^\W\d_]+)*\.?",
+    "may only contain letters, spaces, apostrophes, hyphens and dots",
+)
+register_rule(
+    "phone",
+    r"\+?\d[\d ()-]{5,30}",
+    "must be 6 to 31 digits, spaces, dashes or brackets",
+)
+
+register_rule("text", r"(?s).*", "must be a string")
+RULES["email"] = EmailRule("email", "value is not a valid email address")
+
+# rule applied to each user field, shared by the schemas and batch checks
+USER_FIELD_RULES = {
+    "first_name": "name",
+    "last_name": "name",
+    "phone": "phone",
+}
+
+# every field UserPostSchema requires, so a batch-valid row is schema-valid
+USER_RECORD_RULES = {
+    "first_name": "name",
+    "last_name": "name",
+    "email": "email",
+    "phone": "phone",
+    "password": "text",
+}
+
+
+def validate_rule(rule_name: str, value: str) -> str:
+    """
+    pydantic validator entry point, raises ValueError on a bad value
+    """
+    error_msg = RULES[rule_name].check(value)
+    if error_msg:
+        raise ValueError(error_msg)
+    return value
+
+
+def validate_records(
+    records: Iterable[Mapping],
+    field_rules: Mapping[str, str] = USER_RECORD_RULES,
+) -> List[List[dict]]:
+    """
+    validate many records in one pass, returning the errors of each row in
+    the same shape as the request validation error response
+    """
+    rules = [(field, RULES[name].check) for field, name in field_rules.items()]
+    results = []
+    for record in records:
+        errors = []
+        for field, check in rules:
+            value = record.get(field)
+            if value is None:
+                errors.append({"fields": field, "message": "Field required"})
+                continue
+            error_msg = check(value)
+            if error_msg:
+                errors.append(
+                    {"fields": field, "message": f"Value error, {error_msg}"}
+                )
+        results.append(errors)
+    return results